@@ -0,0 +1,282 @@
+import bisect
+import json
+import os
+import threading
+import time
+from functools import wraps
+from pathlib import Path
+from flask import g, request, Response
+from sqlalchemy import event
+
+
+# Upper bounds in seconds of the latency histogram buckets
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Metrics:
+    """In-process registry of counters, gauges and latency histograms, served at /metrics in Prometheus text format.
+
+    Recording a value only takes a lock and updates a dict. With METRICS_MULTIPROC_DIR set, each process of a pre-fork
+    server writes its values to its own file in that folder at most every METRICS_FLUSH_INTERVAL seconds, and
+    /metrics adds up the files of all the processes. When a process has exited its counters and histograms are moved
+    into an archive file, so they are still counted after a worker restarts, and its gauges are dropped.
+    """
+
+    def __init__(self, app=None):
+        self.buckets = DEFAULT_BUCKETS
+        self.multiproc_dir = None
+        self.flush_interval = 1.0
+        self._types = {}
+        self._values = {}
+        self._histograms = {}
+        self._collectors = []
+        self._last_flush = 0.0
+        self._file = None
+        self._file_pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Times every request and adds the /metrics route
+
+        METRICS_MULTIPROC_DIR is a folder shared by the processes of the server, or None for a single process, the
+        PROMETHEUS_MULTIPROC_DIR environment variable is used if it is not in the config.
+        """
+        self.multiproc_dir = app.config.get(
+            "METRICS_MULTIPROC_DIR", os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+        )
+        self.flush_interval = app.config.get("METRICS_FLUSH_INTERVAL", 1.0)
+        if self.multiproc_dir:
+            Path(self.multiproc_dir).mkdir(parents=True, exist_ok=True)
+
+        app.before_request(self._start_timer)
+        app.after_request(self._record_request)
+        app.add_url_rule("/metrics", "metrics", self.metrics_view)
+        app.extensions["metrics"] = self
+
+    def instrument_engine(self, engine):
+        """Counts the statements run by the engine, e.g. db.engine of the app's Flask-SQLAlchemy object"""
+        if not event.contains(engine, "before_cursor_execute", self._count_query):
+            event.listen(engine, "before_cursor_execute", self._count_query)
+
+    def inc(self, name, value=1, **labels):
+        """Adds the value to a counter"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._types[name] = "counter"
+            self._values[key] = self._values.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        """Adds a duration in seconds to a histogram"""
+        key = (name, tuple(sorted(labels.items())))
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                self._types[name] = "histogram"
+                # A count for each bucket, one for values above the largest bucket, then the sum
+                histogram = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            histogram[index] += 1
+            histogram[-1] += seconds
+
+    def timed(self, name, **labels):
+        """Decorator that records how long each call of the function takes in a histogram"""
+
+        def decorator(function):
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+
+            return wrapper
+
+        return decorator
+
+    def add_collector(self, collect):
+        """Adds a function that is called when the metrics are read
+
+        The function returns a list of (name, type, labels dict, value) where type is "counter" or "gauge", e.g. for
+        the counters that a cache keeps itself.
+        """
+        self._collectors.append(collect)
+
+    def snapshot(self):
+        """Returns the values of this process as a list of [name, type, labels, value] that can be saved as JSON"""
+        with self._lock:
+            entries = [
+                [name, self._types[name], dict(labels), value]
+                for (name, labels), value in self._values.items()
+            ]
+            entries += [
+                [name, "histogram", dict(labels), list(histogram)]
+                for (name, labels), histogram in self._histograms.items()
+            ]
+        for collect in self._collectors:
+            entries += [
+                [name, metric_type, labels, value]
+                for name, metric_type, labels, value in collect()
+            ]
+        return entries
+
+    def flush(self):
+        """Writes the values of this process to its file in the multiprocess folder"""
+        if not self.multiproc_dir:
+            return
+        self._last_flush = time.monotonic()
+        if self._file_pid != os.getpid():
+            # The start time is part of the name so a new process that is given the pid of an old one has its own file
+            self._file_pid = os.getpid()
+            self._file = Path(self.multiproc_dir, f"metrics_{self._file_pid}_{time.time_ns()}.json")
+        write_json(self._file, self.snapshot())
+
+    def collect(self):
+        """Returns the values of all processes added together, keyed on (name, type, labels)"""
+        if not self.multiproc_dir:
+            return add_up([self.snapshot()])
+
+        self.flush()
+        folder = Path(self.multiproc_dir)
+        for path in folder.glob("metrics_*.json"):
+            if not pid_alive(int(path.stem.split("_")[1])):
+                self._archive(path)
+        snapshots = []
+        for path in [*folder.glob("metrics_*.json"), folder.joinpath("archive.json")]:
+            try:
+                snapshots.append(json.loads(path.read_text()))
+            except (OSError, ValueError):
+                # The file does not exist yet, or was archived since the folder was listed
+                continue
+        return add_up(snapshots)
+
+    def _archive(self, path):
+        """Adds the counters and histograms of a process that has exited to archive.json and removes its file"""
+        import fcntl
+
+        claimed = path.with_suffix(f".archiving{os.getpid()}")
+        try:
+            # Only one process can rename the file, so it is only archived once
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return
+        with open(path.with_name("archive.lock"), "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            archive = path.with_name("archive.json")
+            entries = json.loads(archive.read_text()) if archive.exists() else []
+            dead = [entry for entry in json.loads(claimed.read_text()) if entry[1] != "gauge"]
+            totals = add_up([entries, dead])
+            write_json(
+                archive,
+                [[name, metric_type, dict(labels), value] for (name, metric_type, labels), value in totals.items()],
+            )
+        claimed.unlink()
+
+    def render(self):
+        """Returns the metrics of all processes in Prometheus text format"""
+        lines = []
+        typed = set()
+        for (name, metric_type, labels), value in sorted(self.collect().items()):
+            if name not in typed:
+                lines.append(f"# TYPE {name} {metric_type}")
+                typed.add(name)
+            if metric_type != "histogram":
+                lines.append(f"{name}{format_labels(labels)} {value}")
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), value[:-1]):
+                cumulative += count
+                bucket_labels = format_labels(labels + (("le", str(bound)),))
+                lines.append(f"{name}_bucket{bucket_labels} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {value[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+    def metrics_view(self):
+        """Returns the metrics for Prometheus to scrape"""
+        return Response(self.render(), mimetype="text/plain; version=0.0.4")
+
+    def _start_timer(self):
+        g.metrics_start = time.perf_counter()
+
+    def _record_request(self, response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            self.observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - start,
+                endpoint=request.endpoint or "none",
+                method=request.method,
+            )
+            self.inc(
+                "http_requests_total",
+                endpoint=request.endpoint or "none",
+                status=str(response.status_code),
+            )
+        if self.multiproc_dir and time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+        return response
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.inc("db_queries_total")
+
+
+def add_up(snapshots):
+    """Adds together lists of [name, type, labels, value] entries, returns a dict keyed on (name, type, labels)"""
+    totals = {}
+    for entries in snapshots:
+        for name, metric_type, labels, value in entries:
+            key = (name, metric_type, tuple(sorted(labels.items())))
+            if metric_type == "histogram":
+                total = totals.setdefault(key, [0] * len(value))
+                totals[key] = [a + b for a, b in zip(total, value)]
+            else:
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def pid_alive(pid):
+    """Returns True if a process with the pid is running"""
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # The process exists but belongs to another user
+        return True
+    return True
+
+
+def write_json(path, data):
+    """Replaces the file in one step so other processes never read a partly written file"""
+    temp_path = path.with_suffix(f".tmp{os.getpid()}")
+    temp_path.write_text(json.dumps(data))
+    os.replace(temp_path, path)
+
+
+def format_labels(labels):
+    """Formats a tuple of (name, value) pairs as Prometheus labels, e.g. {method="GET"}"""
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def benchmark(requests=100000):
+    """Prints the time taken to record the metrics of one request, i.e. a latency histogram and a counter"""
+    registry = Metrics()
+    start = time.perf_counter()
+    for _ in range(requests):
+        registry.observe("http_request_duration_seconds", 0.003, endpoint="predict", method="GET")
+        registry.inc("http_requests_total", endpoint="predict", status="200")
+    seconds = time.perf_counter() - start
+    print(f"{seconds / requests * 1e6:.2f} microseconds per request ({requests} requests)")
+
+
+if __name__ == "__main__":
+    benchmark()
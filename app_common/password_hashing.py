@@ -0,0 +1,101 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from werkzeug import security
+
+
+class HashingBusyError(RuntimeError):
+    """Raised when too many passwords are already waiting to be hashed, or a hash took longer than the timeout"""
+
+
+class PasswordHasher:
+    """Runs password hashing on a small, bounded pool of threads, shared by the iris and paralympic apps.
+
+    Hashing a password is deliberately slow. Limiting how many hashes run at once means a burst of logins or
+    registrations can only use that many CPUs, the rest stay free for the other routes. This limits CPU use, not
+    request threads: the request thread still waits for its hash to finish. When more than the maximum queue of
+    requests are waiting the request fails straight away with HashingBusyError instead of queueing, and a request that
+    waits longer than the timeout also gets HashingBusyError.
+    """
+
+    def __init__(self, app=None):
+        self.max_workers = 2
+        self.max_queue = 32
+        self.timeout = 10.0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self._executor = None
+        self._slots = None
+        self._size = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the pool from the app config
+
+        PASSWORD_HASHING_WORKERS is the number of hashes that can run at once, PASSWORD_HASHING_MAX_QUEUE is the number
+        of requests that can wait for a worker and PASSWORD_HASHING_TIMEOUT is the number of seconds a request waits.
+        """
+        self.max_workers = app.config.get("PASSWORD_HASHING_WORKERS", 2)
+        self.max_queue = app.config.get("PASSWORD_HASHING_MAX_QUEUE", 32)
+        self.timeout = app.config.get("PASSWORD_HASHING_TIMEOUT", 10.0)
+        size = (self.max_workers, self.max_queue)
+        with self._lock:
+            # Each app of a process, e.g. in the tests, shares the pool unless it asks for a different size
+            if self._executor is None or self._size != size:
+                if self._executor is not None:
+                    # Hashes already running finish on the old pool and release its own slots
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="password-hashing"
+                )
+                self._slots = threading.BoundedSemaphore(self.max_workers + self.max_queue)
+                self._size = size
+        app.extensions["password_hasher"] = self
+
+    def generate_password_hash(self, password):
+        """Returns the werkzeug hash of the password, hashed on the pool"""
+        return self._run(security.generate_password_hash, password)
+
+    def check_password_hash(self, pwhash, password):
+        """Checks the password against the werkzeug hash on the pool"""
+        return self._run(security.check_password_hash, pwhash, password)
+
+    def stats(self):
+        """Returns the pool counters as a dict, queued is the number of requests waiting for a worker"""
+        with self._lock:
+            in_flight = self.submitted - self.completed
+            return {
+                "workers": self.max_workers,
+                "in_flight": in_flight,
+                "queued": max(0, in_flight - self.max_workers),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "rejected": self.rejected,
+            }
+
+    def _run(self, function, *args):
+        with self._lock:
+            executor, slots = self._executor, self._slots
+        if executor is None:
+            # Not configured by an app, e.g. when the models are used in a script
+            return function(*args)
+        if not slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise HashingBusyError("Too many passwords are waiting to be hashed")
+        with self._lock:
+            self.submitted += 1
+        future = executor.submit(function, *args)
+        future.add_done_callback(lambda future: self._done(slots))
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError as err:
+            # The hash carries on in the pool and keeps its slot until it finishes, only the request stops waiting
+            raise HashingBusyError("Timed out waiting for the password to be hashed") from err
+
+    def _done(self, slots):
+        with self._lock:
+            self.completed += 1
+        slots.release()
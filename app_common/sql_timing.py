@@ -0,0 +1,97 @@
+import logging
+import time
+from flask import current_app, g, has_request_context, request
+from sqlalchemy import event
+
+
+logger = logging.getLogger(__name__)
+
+
+class SQLTiming:
+    """Counts and times the SQL statements run for each request, in place of logging every statement with SQLALCHEMY_ECHO.
+
+    The number of statements and the time spent in the database are added to each response in a Server-Timing header,
+    which the browser developer tools show with the request, and are logged at debug level when the app is in debug
+    mode. A streamed response has no header, as its statements run after the headers are sent, and is logged when the
+    stream is closed. A statement that takes longer than SQL_SLOW_QUERY_SECONDS is logged as a warning with its
+    parameters and the route that ran it.
+    """
+
+    def __init__(self, app=None):
+        self.slow_query_seconds = 0.1
+        self.server_timing = True
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Adds the Server-Timing header to the responses of the app
+
+        SQL_SLOW_QUERY_SECONDS is the time above which a statement is logged, None to log no statements, and
+        SQL_SERVER_TIMING turns the header on or off.
+        """
+        self.slow_query_seconds = app.config.get("SQL_SLOW_QUERY_SECONDS", 0.1)
+        self.server_timing = app.config.get("SQL_SERVER_TIMING", True)
+        app.after_request(self._add_timing)
+        app.extensions["sql_timing"] = self
+
+    def instrument_engine(self, engine):
+        """Times the statements run by the engine, e.g. db.engine of the app's Flask-SQLAlchemy object"""
+        if not event.contains(engine, "before_cursor_execute", self._start_query):
+            event.listen(engine, "before_cursor_execute", self._start_query)
+            event.listen(engine, "after_cursor_execute", self._end_query)
+
+    def _start_query(self, conn, cursor, statement, parameters, context, executemany):
+        conn.info["sql_timing_start"] = time.perf_counter()
+
+    def _end_query(self, conn, cursor, statement, parameters, context, executemany):
+        start = conn.info.pop("sql_timing_start", None)
+        if start is None:
+            return
+        seconds = time.perf_counter() - start
+        if has_request_context():
+            g.sql_queries = g.get("sql_queries", 0) + 1
+            g.sql_seconds = g.get("sql_seconds", 0.0) + seconds
+        if self.slow_query_seconds is not None and seconds >= self.slow_query_seconds:
+            route = f"{request.method} {request.path}" if has_request_context() else "no request"
+            logger.warning(
+                "Slow query took %.1f ms on %s: %s parameters %s",
+                seconds * 1000,
+                route,
+                statement,
+                format_parameters(parameters, executemany),
+            )
+
+    def _add_timing(self, response):
+        if response.is_streamed:
+            # The body, and its queries, are only made after the headers are sent, so the totals are logged once the
+            # stream is closed and there is no header
+            app = current_app._get_current_object()
+            request_g = g._get_current_object()
+            method, path = request.method, request.path
+            response.call_on_close(lambda: log_totals(app, method, path, request_g))
+            return response
+        if self.server_timing:
+            queries = g.get("sql_queries", 0)
+            seconds = g.get("sql_seconds", 0.0)
+            response.headers.add("Server-Timing", f'db;dur={seconds * 1000:.2f};desc="SQL statements: {queries}"')
+        log_totals(current_app, request.method, request.path, g)
+        return response
+
+
+def log_totals(app, method, path, request_g):
+    """Logs the number of queries of a request and the time they took, when the app is in debug mode"""
+    if app.debug:
+        app.logger.debug(
+            "%s %s ran %d queries in %.1f ms",
+            method,
+            path,
+            request_g.get("sql_queries", 0),
+            request_g.get("sql_seconds", 0.0) * 1000,
+        )
+
+
+def format_parameters(parameters, executemany):
+    """Returns the parameters of a statement for the log, only the first row of an executemany is shown"""
+    if executemany and parameters:
+        return f"{parameters[0]!r} and {len(parameters) - 1} more rows"
+    return repr(parameters)
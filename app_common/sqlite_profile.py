@@ -0,0 +1,23 @@
+from sqlalchemy import event
+
+
+def set_sqlite_pragmas(engine, pragmas):
+    """Runs PRAGMA statements on every new connection of an SQLite engine, e.g. db.engine of the app
+
+    Call it before the engine opens its first connection. Nothing is done for other databases.
+
+    Parameters:
+    engine (Engine): SQLAlchemy engine
+    pragmas (dict): Values keyed by pragma name, e.g. {"journal_mode": "WAL", "busy_timeout": 5000}
+    """
+    if engine.dialect.name != "sqlite" or not pragmas:
+        return
+    statements = [f"PRAGMA {name} = {value}" for name, value in pragmas.items()]
+
+    def connect(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.close()
+
+    event.listen(engine, "connect", connect)
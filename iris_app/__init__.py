@@ -1,7 +1,15 @@
+import os
 from pathlib import Path
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager
+from app_common.metrics import Metrics
+from app_common.password_hashing import PasswordHasher
+from app_common.sqlite_profile import set_sqlite_pragmas
+from iris_app.micro_batcher import MicroBatcher
+from iris_app.model_registry import ModelRegistry
+from iris_app.prediction_cache import PredictionCache
+from iris_app.user_cache import UserCache
 
 
 # Iris app folder
@@ -13,6 +21,24 @@ db = SQLAlchemy()
 # Create Flask-Login
 login_manager = LoginManager()
 
+# Create the cache of logged in users used by the Flask-Login user loader
+user_cache = UserCache()
+
+# Create the pool that limits how many passwords are hashed at once
+password_hasher = PasswordHasher()
+
+# Create the registry of prediction models
+model_registry = ModelRegistry()
+
+# Create the cache of recent predictions
+prediction_cache = PredictionCache()
+
+# Create the batcher that scores concurrent single-row predictions together
+micro_batcher = MicroBatcher()
+
+# Create the registry of request, inference and database metrics
+metrics = Metrics()
+
 
 # Custom error routes
 def internal_server_error(e):
@@ -23,8 +49,40 @@ def page_not_found(e):
     return render_template("404.html"), 404
 
 
-def create_app():
-    """Create and configure the Flask app"""
+def cache_metrics():
+    """Returns the counters kept by the caches, the password hasher and the micro-batcher for /metrics"""
+    predictions = prediction_cache.stats()
+    users = user_cache.stats()
+    hashing = password_hasher.stats()
+    batches = micro_batcher.stats()
+    return [
+        ("iris_prediction_cache_hits_total", "counter", {}, predictions["hits"]),
+        ("iris_prediction_cache_misses_total", "counter", {}, predictions["misses"]),
+        ("iris_prediction_cache_entries", "gauge", {}, predictions["size"]),
+        ("iris_user_cache_hits_total", "counter", {}, users["hits"]),
+        ("iris_user_cache_misses_total", "counter", {}, users["misses"]),
+        ("password_hashing_queued", "gauge", {}, hashing["queued"]),
+        ("password_hashing_rejected_total", "counter", {}, hashing["rejected"]),
+        ("iris_microbatch_batches_total", "counter", {}, batches["batches"]),
+        ("iris_microbatch_rows_total", "counter", {}, batches["rows"]),
+    ]
+
+
+def model_path(name):
+    """Returns the memory-mapped artifact folder for the model written by create_ml_model.py, or the pickle if there is
+    no artifact folder"""
+    folder = PROJECT_ROOT.joinpath("data", f"model_{name}")
+    if folder.joinpath("manifest.json").exists():
+        return folder
+    return PROJECT_ROOT.joinpath("data", f"model_{name}.pkl")
+
+
+def create_app(config=None):
+    """Create and configure the Flask app
+
+    Parameters:
+    config (dict): Settings that replace the defaults below, e.g. for a test or benchmark
+    """
     app = Flask(__name__)
     app.config["SECRET_KEY"] = "saULPgD9XU8vzLVk7kyLBw"
     # configure the SQLite database location
@@ -33,6 +91,54 @@ def create_app():
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     app.config["SQLALCHEMY_ECHO"] = False
+    # SQLite settings for each new connection: readers do not wait for writers with the write-ahead log, commits only
+    # sync at checkpoints, a 16 MB page cache, reads through a 128 MB memory map, and a wait of up to 5 seconds for a lock
+    app.config["SQLITE_PRAGMAS"] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    }
+    # Connections kept open for the request threads, up to pool_size + max_overflow at once
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": 10, "max_overflow": 20, "pool_timeout": 10}
+    # Cache of logged in users, a user is read from the database again after the TTL in seconds
+    app.config["IRIS_USER_CACHE_SIZE"] = 10000
+    app.config["IRIS_USER_CACHE_TTL"] = 60.0
+    # Passwords are hashed by at most this many threads at once, further requests wait in a queue of limited size
+    app.config["PASSWORD_HASHING_WORKERS"] = 2
+    app.config["PASSWORD_HASHING_MAX_QUEUE"] = 32
+    app.config["PASSWORD_HASHING_TIMEOUT"] = 10.0
+    # Prediction models, a request can choose one by name
+    app.config["IRIS_MODELS"] = {"lr": model_path("lr"), "dt": model_path("dt")}
+    app.config["IRIS_DEFAULT_MODEL"] = "lr"
+    # Seconds between checks for a newer model file
+    app.config["IRIS_MODEL_CHECK_INTERVAL"] = 2.0
+    # "compiled" scores pickled models with their NumPy versions, which give the same predictions as scikit-learn
+    # (see tests/test_compiled_models.py). Use "sklearn" to call the scikit-learn models directly.
+    app.config["IRIS_INFERENCE_MODE"] = "compiled"
+    # Load the models in a background thread once the app is created, rather than when the first prediction is made
+    app.config["IRIS_WARM_UP"] = True
+    # Cache of recent predictions, values are rounded to the 0.1 cm resolution of the measurements
+    app.config["IRIS_PREDICTION_CACHE_SIZE"] = 10000
+    app.config["IRIS_PREDICTION_CACHE_TTL"] = 3600.0
+    app.config["IRIS_PREDICTION_CACHE_RESOLUTION"] = 0.1
+    # Micro-batching of concurrent single-row predictions, turn on when running a threaded server
+    app.config["IRIS_MICROBATCH_ENABLED"] = False
+    app.config["IRIS_MICROBATCH_WINDOW"] = 0.002
+    app.config["IRIS_MICROBATCH_MAX_ROWS"] = 64
+    # Threads that make the predictions for /predict when the app is served by the ASGI app in asgi.py
+    app.config["IRIS_ASGI_INFERENCE_WORKERS"] = 4
+    # Rows per page of the iris data set page, and rows fetched at a time when it is streamed
+    app.config["IRIS_PAGE_SIZE"] = 50
+    app.config["IRIS_MAX_PAGE_SIZE"] = 1000
+    app.config["IRIS_STREAM_YIELD_PER"] = 500
+    # Folder shared by the worker processes of a pre-fork server so /metrics covers all of them, None for one process
+    app.config["METRICS_MULTIPROC_DIR"] = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    app.config["METRICS_FLUSH_INTERVAL"] = 1.0
+    if config:
+        app.config.update(config)
 
     # Register error handlers
     app.register_error_handler(500, internal_server_error)
@@ -44,14 +150,38 @@ def create_app():
     # Register the login manager and set the default view for login
     login_manager.login_view = "login"
     login_manager.init_app(app)
+    user_cache.init_app(app)
+    password_hasher.init_app(app)
+
+    # Register the prediction models, they are loaded when first used
+    model_registry.init_app(app)
+
+    # Configure the prediction cache and empty it whenever a model is reloaded
+    prediction_cache.init_app(app)
+    model_registry.add_listener(prediction_cache.clear)
+
+    # Configure the micro-batcher
+    micro_batcher.init_app(app)
+
+    # Time every request and serve the metrics at /metrics
+    metrics.init_app(app)
+    metrics.add_collector(cache_metrics)
 
     # Include the routes from routes.py
     with app.app_context():
         from . import routes
 
+        # Apply SQLITE_PRAGMAS to each connection, before the first one is opened
+        set_sqlite_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+        # Count the queries run on this app's database
+        metrics.instrument_engine(db.engine)
+
         # Create the tables in the database if they do not already exist
         from .models import Iris
 
         db.create_all()
 
+    if app.config["IRIS_WARM_UP"]:
+        model_registry.warm_up()
+
     return app
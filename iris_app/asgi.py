@@ -0,0 +1,120 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs
+from iris_app import create_app, metrics, model_registry
+
+
+# Query string arguments of /predict in the order the model expects them
+PREDICT_ARGS = ["sep-len", "sep-wid", "pet-len", "pet-wid"]
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPredictionApp:
+    """ASGI app that answers GET /predict on the event loop and passes every other request to the Flask app.
+
+    An open /predict connection only costs a coroutine, the thread pool is used for the prediction itself, so many
+    keep-alive clients can be served by one process. Every other route runs in the Flask app through asgiref's
+    WsgiToAsgi adapter, which runs each request on a thread as before.
+    """
+
+    def __init__(self, flask_app):
+        try:
+            from asgiref.wsgi import WsgiToAsgi
+        except ImportError as err:
+            raise ImportError(
+                "The ASGI app needs asgiref, install it with: pip install asgiref uvicorn"
+            ) from err
+        # Imported here as the routes module can only be imported once the app has been created
+        from iris_app.routes import make_prediction
+
+        self.flask_app = flask_app
+        self.wsgi_app = WsgiToAsgi(flask_app)
+        self.make_prediction = make_prediction
+        self.executor = ThreadPoolExecutor(
+            max_workers=flask_app.config.get("IRIS_ASGI_INFERENCE_WORKERS", 4),
+            thread_name_prefix="iris-inference",
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http" and scope["path"] == "/predict" and scope["method"] == "GET":
+            await self.predict(scope, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+    async def predict(self, scope, send):
+        """Async version of the /predict route, the prediction is made on the thread pool"""
+        start = time.perf_counter()
+        args = parse_qs(scope["query_string"].decode("latin-1"))
+        model_name = args.get("model", [None])[0]
+        if model_name is not None and model_name not in model_registry:
+            status, body = bad_request(f"Unknown model: {model_name}")
+        else:
+            values = [args.get(name, [None])[0] for name in PREDICT_ARGS]
+            loop = asyncio.get_running_loop()
+            try:
+                prediction = await loop.run_in_executor(
+                    self.executor, self.make_prediction, values, model_name
+                )
+                status, body = 200, (prediction.encode(), b"text/html; charset=utf-8")
+            except (TypeError, ValueError) as err:
+                status, body = bad_request(f"Invalid flower values: {err}")
+            except Exception:
+                # e.g. the model file could not be loaded, answered like Flask's internal server error
+                logger.exception("Prediction failed")
+                status, body = server_error()
+
+        content, content_type = body
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", content_type),
+                    (b"content-length", str(len(content)).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": content})
+        metrics.observe(
+            "http_request_duration_seconds", time.perf_counter() - start, endpoint="predict", method="GET"
+        )
+        metrics.inc("http_requests_total", endpoint="predict", status=str(status))
+
+    async def lifespan(self, receive, send):
+        """Handles the server start up and shut down messages, the thread pool is shut down with the server"""
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def bad_request(text):
+    """Returns status 400 and the same JSON body as bad_request in routes.py"""
+    content = json.dumps({"status": 400, "error": "Bad request", "message": text})
+    return 400, (content.encode(), b"application/json")
+
+
+def server_error():
+    """Returns status 500 and a JSON body in the same format as bad_request"""
+    content = json.dumps(
+        {"status": 500, "error": "Internal server error", "message": "The prediction could not be made"}
+    )
+    return 500, (content.encode(), b"application/json")
+
+
+def create_asgi_app():
+    """Create the Flask app and wrap it in the ASGI app
+
+    Run with an ASGI server, e.g. uvicorn --factory iris_app.asgi:create_asgi_app
+    """
+    return AsyncPredictionApp(create_app())
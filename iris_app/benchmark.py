@@ -0,0 +1,329 @@
+import argparse
+import threading
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+
+# Iris data used to fit the models that are benchmarked
+iris_file = Path(__file__).parent.joinpath("data", "iris.csv")
+
+
+def fit_models():
+    """Fits the logistic regression and decision tree models used by the app on the iris data"""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.tree import DecisionTreeClassifier
+    from iris_app.data.create_ml_model import prepare_data
+
+    X, y = prepare_data(pd.read_csv(iris_file))
+    models = {
+        "lr": LogisticRegression(max_iter=1000).fit(X, y),
+        "dt": DecisionTreeClassifier(random_state=42).fit(X, y),
+    }
+    return models, X
+
+
+def sample_rows(X, rows, seed=42):
+    """Returns rows of flower values sampled from the iris data"""
+    return X[np.random.default_rng(seed).integers(0, len(X), rows)]
+
+
+def time_calls(function, calls):
+    """Returns the median number of seconds taken by a call to the function"""
+    times = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def create_benchmark_app(**config):
+    """Creates the iris app with the prediction cache turned off, so every request is scored by the model"""
+    from iris_app import create_app
+
+    return create_app({"IRIS_PREDICTION_CACHE_SIZE": 0, **config})
+
+
+def predict_url(values):
+    return "/predict?sep-len={}&sep-wid={}&pet-len={}&pet-wid={}".format(*values)
+
+
+def benchmark_batch(args):
+    """Rows per second scored by the batch route compared with one /predict request per row, using the test client"""
+    _, X = fit_models()
+    app = create_benchmark_app()
+    client = app.test_client()
+    rows = sample_rows(X, args.rows)
+    urls = [predict_url(values) for values in rows.tolist()]
+    # Load the model before timing
+    client.get(urls[0])
+
+    start = time.perf_counter()
+    for url in urls:
+        client.get(url)
+    single = time.perf_counter() - start
+
+    body = rows.tolist()
+    start = time.perf_counter()
+    for _ in range(args.repeat):
+        response = client.post("/predict/batch", json=body)
+    batch = (time.perf_counter() - start) / args.repeat
+    assert len(response.json["predictions"]) == args.rows
+
+    print(f"GET /predict, 1 row per request:        {args.rows / single:>12,.0f} rows/sec")
+    print(f"POST /predict/batch, {args.rows} rows as JSON: {args.rows / batch:>12,.0f} rows/sec")
+
+
+def serve(port, config):
+    """Runs the iris app on a threaded WSGI server, in its own process so the load does not compete with it"""
+    import logging
+    from werkzeug.serving import make_server
+
+    # Do not log every request
+    logging.getLogger("werkzeug").setLevel(logging.WARNING)
+    make_server("127.0.0.1", port, create_benchmark_app(**config), threaded=True).serve_forever()
+
+
+def run_load(port, urls, concurrency, seconds):
+    """Sends requests from concurrency threads for the number of seconds, returns the latency of each request"""
+    import http.client
+
+    latencies = []
+    deadline = time.monotonic() + seconds
+
+    def client(offset):
+        index = offset
+        while time.monotonic() < deadline:
+            connection = http.client.HTTPConnection("127.0.0.1", port)
+            start = time.perf_counter()
+            connection.request("GET", urls[index % len(urls)])
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+            connection.close()
+            index += concurrency
+
+    threads = [threading.Thread(target=client, args=(offset,)) for offset in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies
+
+
+def benchmark_microbatch(args):
+    """Throughput and p99 latency of GET /predict on a threaded server, with and without micro-batching"""
+    import multiprocessing
+
+    _, X = fit_models()
+    urls = [predict_url(values) for values in sample_rows(X, 10000).tolist()]
+    print(f"{args.concurrency} concurrent clients, {args.mode} models")
+    for enabled in (False, True):
+        config = {
+            "IRIS_INFERENCE_MODE": args.mode,
+            "IRIS_MICROBATCH_ENABLED": enabled,
+            "IRIS_MICROBATCH_WINDOW": args.window,
+        }
+        server = multiprocessing.Process(target=serve, args=(args.port, config), daemon=True)
+        server.start()
+        try:
+            wait_for_port(args.port)
+            # The first requests load the model
+            run_load(args.port, urls, args.concurrency, 1)
+            latencies = run_load(args.port, urls, args.concurrency, args.seconds)
+        finally:
+            server.terminate()
+            server.join()
+        p50, p99 = np.percentile(latencies, [50, 99]) * 1000
+        label = f"micro-batching {args.window * 1000:g}ms" if enabled else "no batching"
+        print(
+            f"{label:<22}{len(latencies) / args.seconds:>10,.0f} requests/sec   "
+            f"p50 {p50:.1f}ms   p99 {p99:.1f}ms"
+        )
+
+
+def wait_for_port(port, timeout=30):
+    """Waits until a server is listening on the port"""
+    import socket
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Nothing is listening on port {port}")
+
+
+def logged_in_latency(database, cache_size, requests, results):
+    """Logs in to a copy of the database and times GET / as the logged in user, run in its own process"""
+    app = create_benchmark_app(
+        SQLALCHEMY_DATABASE_URI=f"sqlite:///{database}",
+        WTF_CSRF_ENABLED=False,
+        IRIS_USER_CACHE_SIZE=cache_size,
+        IRIS_WARM_UP=False,
+    )
+    client = app.test_client()
+    user = {"email": "benchmark@example.com", "password": "benchmark-password"}
+    client.post("/register", data=user)
+    client.post("/login", data=user)
+    assert b"Logout" in client.get("/").data, "The benchmark user could not log in"
+    results.put(time_calls(lambda: client.get("/"), requests))
+
+
+def benchmark_user_cache(args):
+    """Latency of a page for a logged in user with the user cache turned off and on"""
+    import multiprocessing
+    import shutil
+    import tempfile
+
+    results = multiprocessing.Queue()
+    with tempfile.TemporaryDirectory() as folder:
+        for label, cache_size in (("no user cache", 0), ("user cache", 10000)):
+            database = Path(folder, f"iris_{cache_size}.db")
+            shutil.copy(Path(__file__).parent.joinpath("data", "iris.db"), database)
+            # Each run is a new process as the routes can only be added to one app in a process
+            run = multiprocessing.Process(
+                target=logged_in_latency, args=(database, cache_size, args.requests, results)
+            )
+            run.start()
+            seconds = results.get(timeout=600)
+            run.join()
+            print(f"{label:<16} GET / median {seconds * 1e6:,.0f}us")
+
+
+def memory_kb():
+    """Returns the resident and proportional set sizes of this process in kB, from /proc so Linux only
+
+    Pages shared with other processes, such as a memory-mapped file, count in full in the resident set size but are
+    divided between the processes that share them in the proportional set size.
+    """
+    sizes = {}
+    for line in Path("/proc/self/smaps_rollup").read_text().splitlines():
+        name, _, value = line.partition(":")
+        if name in ("Rss", "Pss"):
+            sizes[name] = int(value.split()[0])
+    return sizes["Rss"], sizes["Pss"]
+
+
+def load_worker(model_format, path, features, started, barrier, results, done):
+    """Loads the model as a worker process of the app would and reports its start-up time and memory"""
+    if model_format == "pickle":
+        import pickle
+
+        with open(path, "rb") as pickle_file:
+            model = pickle.load(pickle_file)
+    else:
+        from iris_app.compiled_models import load_artifact
+
+        model = load_artifact(path)
+    model.predict(features)
+    seconds = time.time() - started
+    # Measure once every worker has loaded the model, so the shared pages are divided between all of them
+    barrier.wait()
+    results.put((seconds, *memory_kb()))
+    done.wait()
+
+
+def benchmark_workers(args):
+    """Start-up time and memory of worker processes loading a pickled model or memory-mapping an artifact"""
+    import multiprocessing
+    import pickle
+    import tempfile
+    from sklearn.tree import DecisionTreeClassifier
+    from iris_app.compiled_models import compile_model, save_artifact
+
+    # A tree fitted to noisy data has many nodes, standing in for a larger model than the iris models
+    _, X = fit_models()
+    features = sample_rows(X, args.tree_rows) + np.random.default_rng(42).normal(0, 0.5, (args.tree_rows, 4))
+    labels = np.random.default_rng(42).integers(0, 3, args.tree_rows)
+    model = DecisionTreeClassifier(random_state=42).fit(features, labels)
+    print(f"Decision tree with {model.tree_.node_count:,} nodes, {args.workers} worker processes")
+
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as folder:
+        paths = {"pickle": Path(folder, "model.pkl"), "artifact": Path(folder, "model")}
+        with open(paths["pickle"], "wb") as pickle_file:
+            pickle.dump(model, pickle_file)
+        save_artifact(compile_model(model), paths["artifact"])
+
+        for model_format, path in paths.items():
+            barrier = context.Barrier(args.workers)
+            results = context.Queue()
+            done = context.Event()
+            started = time.time()
+            workers = [
+                context.Process(
+                    target=load_worker,
+                    args=(model_format, path, features[:1000], started, barrier, results, done),
+                )
+                for _ in range(args.workers)
+            ]
+            for worker in workers:
+                worker.start()
+            measured = [results.get(timeout=600) for _ in workers]
+            done.set()
+            for worker in workers:
+                worker.join()
+            seconds, rss, pss = zip(*measured)
+            print(
+                f"{model_format:<10} ready in {max(seconds):.2f}s, "
+                f"total RSS {sum(rss) / 1024:,.0f} MB, total PSS {sum(pss) / 1024:,.0f} MB"
+            )
+
+
+def benchmark_inference(args):
+    """Single-row latency and batch throughput of the scikit-learn and compiled models"""
+    from iris_app.compiled_models import compile_model
+
+    models, X = fit_models()
+    row = X[:1]
+    batch = sample_rows(X, args.rows)
+    print(f"{'model':<6}{'mode':<10}{'1 row (us)':>12}{f'{args.rows} rows (rows/sec)':>26}")
+    for name, model in models.items():
+        for mode, predictor in (("sklearn", model), ("compiled", compile_model(model))):
+            single = time_calls(lambda: predictor.predict(row), args.calls)
+            many = time_calls(lambda: predictor.predict(batch), 20)
+            print(f"{name:<6}{mode:<10}{single * 1e6:>12.1f}{args.rows / many:>26,.0f}")
+
+
+def main():
+    """Benchmarks for the iris app, e.g. python -m iris_app.benchmark inference"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    batch = benchmarks.add_parser("batch", help=benchmark_batch.__doc__)
+    batch.add_argument("--rows", type=int, default=2000, help="rows scored by each route")
+    batch.add_argument("--repeat", type=int, default=20, help="batch requests to time")
+    batch.set_defaults(run=benchmark_batch)
+
+    microbatch = benchmarks.add_parser("microbatch", help=benchmark_microbatch.__doc__)
+    microbatch.add_argument("--concurrency", type=int, default=32, help="concurrent clients")
+    microbatch.add_argument("--seconds", type=float, default=10, help="length of each run")
+    microbatch.add_argument("--window", type=float, default=0.002, help="micro-batch window in seconds")
+    microbatch.add_argument("--mode", choices=["compiled", "sklearn"], default="sklearn", help="inference mode")
+    microbatch.add_argument("--port", type=int, default=5099, help="port for the benchmark server")
+    microbatch.set_defaults(run=benchmark_microbatch)
+
+    user_cache = benchmarks.add_parser("user-cache", help=benchmark_user_cache.__doc__)
+    user_cache.add_argument("--requests", type=int, default=2000, help="requests to time")
+    user_cache.set_defaults(run=benchmark_user_cache)
+
+    workers = benchmarks.add_parser("workers", help=benchmark_workers.__doc__)
+    workers.add_argument("--workers", type=int, default=8, help="worker processes")
+    workers.add_argument("--tree-rows", type=int, default=500000, help="rows used to fit the decision tree")
+    workers.set_defaults(run=benchmark_workers)
+
+    inference = benchmarks.add_parser("inference", help=benchmark_inference.__doc__)
+    inference.add_argument("--calls", type=int, default=2000, help="single-row predictions to time")
+    inference.add_argument("--rows", type=int, default=100000, help="rows in the batch")
+    inference.set_defaults(run=benchmark_inference)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
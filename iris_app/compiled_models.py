@@ -0,0 +1,175 @@
+import json
+import os
+import shutil
+import time
+import numpy as np
+
+
+# Value used by scikit-learn for the child of a leaf node
+TREE_LEAF = -1
+
+
+class CompiledLogisticRegression:
+    """Logistic regression classifier scored with a matrix multiply and argmax, without scikit-learn's input checks.
+
+    Uses the same operations in the same order as LogisticRegression.predict so the predictions are identical.
+    """
+
+    kind = "logistic_regression"
+
+    def __init__(self, coef, intercept, classes):
+        self.coef = coef
+        self.intercept = intercept
+        self.classes = classes
+
+    @classmethod
+    def from_model(cls, model):
+        return cls(model.coef_, model.intercept_, model.classes_)
+
+    def to_arrays(self):
+        """Returns the fitted values as a dict of numpy arrays"""
+        return {
+            "coef": self.coef,
+            "intercept": self.intercept,
+            "classes": self.classes,
+        }
+
+    def predict(self, features):
+        scores = np.asarray(features, dtype=np.float64) @ self.coef.T + self.intercept
+        if scores.shape[1] == 1:
+            # Binary classification has a single column of scores for the positive class
+            return self.classes[(scores[:, 0] > 0).astype(int)]
+        return self.classes[scores.argmax(axis=1)]
+
+
+class CompiledDecisionTree:
+    """Decision tree classifier scored by walking the tree arrays for all rows at once.
+
+    As in DecisionTreeClassifier.predict the features are compared as float32, so the predictions are identical.
+    """
+
+    kind = "decision_tree"
+
+    def __init__(self, children_left, children_right, feature, threshold, value, classes):
+        self.children_left = children_left
+        self.children_right = children_right
+        self.feature = feature
+        self.threshold = threshold
+        self.value = value
+        self.classes = classes
+
+    @classmethod
+    def from_model(cls, model):
+        tree = model.tree_
+        return cls(
+            tree.children_left,
+            tree.children_right,
+            tree.feature,
+            tree.threshold,
+            tree.value[:, 0, :],
+            model.classes_,
+        )
+
+    def to_arrays(self):
+        """Returns the tree structure as a dict of numpy arrays"""
+        return {
+            "children_left": self.children_left,
+            "children_right": self.children_right,
+            "feature": self.feature,
+            "threshold": self.threshold,
+            "value": self.value,
+            "classes": self.classes,
+        }
+
+    def predict(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.arange(len(features))
+        nodes = np.zeros(len(features), dtype=np.intp)
+        while True:
+            left = self.children_left[nodes]
+            active = left != TREE_LEAF
+            if not active.any():
+                break
+            # Leaves have feature -2, their rows are not moved by the np.where below
+            go_left = features[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(
+                active, np.where(go_left, left, self.children_right[nodes]), nodes
+            )
+        return self.classes[self.value[nodes].argmax(axis=1)]
+
+
+def compile_model(model):
+    """Converts a fitted scikit-learn model to the equivalent compiled model
+
+    Parameters:
+    model: Fitted LogisticRegression or DecisionTreeClassifier
+
+    Returns:
+    CompiledLogisticRegression or CompiledDecisionTree
+
+    Raises:
+    TypeError: if there is no compiled version of the model
+    """
+    # Imported here as scikit-learn is slow to import and is not needed to load an artifact
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.tree import DecisionTreeClassifier
+
+    if isinstance(model, LogisticRegression):
+        return CompiledLogisticRegression.from_model(model)
+    if isinstance(model, DecisionTreeClassifier) and model.n_outputs_ == 1:
+        return CompiledDecisionTree.from_model(model)
+    raise TypeError(f"Cannot compile a {type(model).__name__} model")
+
+
+def predictions_match(compiled, model, features):
+    """Checks that the compiled model gives exactly the same predictions as the original model for every row"""
+    return np.array_equal(compiled.predict(features), model.predict(features))
+
+
+# Compiled model classes by the kind saved in an artifact manifest
+COMPILED_MODELS = {
+    model.kind: model for model in (CompiledLogisticRegression, CompiledDecisionTree)
+}
+
+
+def save_artifact(compiled, folder):
+    """Saves a compiled model as a folder of .npy arrays that can be memory-mapped
+
+    The arrays are written to a new subfolder and then manifest.json, which names the subfolder, is replaced in one
+    step. A running app that has memory-mapped the previous arrays keeps using them until it sees the new manifest.
+
+    Parameters:
+    compiled: CompiledLogisticRegression or CompiledDecisionTree
+    folder (Path): Artifact folder, e.g. data/model_lr
+    """
+    version = str(time.time_ns())
+    array_folder = folder.joinpath(version)
+    array_folder.mkdir(parents=True)
+    for name, array in compiled.to_arrays().items():
+        np.save(array_folder.joinpath(f"{name}.npy"), np.ascontiguousarray(array))
+
+    manifest = folder.joinpath("manifest.json")
+    previous = json.loads(manifest.read_text())["version"] if manifest.exists() else None
+    temp_manifest = folder.joinpath("manifest.tmp")
+    temp_manifest.write_text(json.dumps({"kind": compiled.kind, "version": version}))
+    os.replace(temp_manifest, manifest)
+
+    # Keep the previous arrays for processes that have not reloaded yet, remove any older ones
+    for old_folder in folder.iterdir():
+        if old_folder.is_dir() and old_folder.name not in (version, previous):
+            shutil.rmtree(old_folder)
+
+
+def load_artifact(folder, mmap_mode="r"):
+    """Loads a compiled model saved by save_artifact, the arrays are memory-mapped read only by default
+
+    Memory-mapped arrays are shared through the operating system's page cache, so every worker process of a server
+    uses the same copy of the model in memory.
+    """
+    manifest = json.loads(folder.joinpath("manifest.json").read_text())
+    array_folder = folder.joinpath(manifest["version"])
+    arrays = {
+        path.stem: np.load(path, mmap_mode=mmap_mode)
+        for path in array_folder.glob("*.npy")
+    }
+    return COMPILED_MODELS[manifest["kind"]](**arrays)
@@ -1,11 +1,56 @@
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import os
 import pandas as pd
 from sklearn.tree import DecisionTreeClassifier
 from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import (
+    train_test_split,
+    cross_validate,
+    StratifiedKFold,
+    ParameterGrid,
+)
 from sklearn.metrics import classification_report, accuracy_score
 from sklearn.preprocessing import LabelEncoder
 import pickle
+# Needs the iris_app package, run as a module from the project folder: python -m iris_app.data.create_ml_model
+from iris_app.compiled_models import compile_model, save_artifact
+
+
+# Candidate algorithms and the hyperparameter values to try for each.
+# The names match the model names in the iris app, the winner for each is saved as model_<name>.pkl
+CANDIDATES = {
+    "lr": (
+        LogisticRegression,
+        {"C": [0.01, 0.1, 1.0, 10.0, 100.0], "max_iter": [1000]},
+    ),
+    "dt": (
+        DecisionTreeClassifier,
+        {
+            "criterion": ["gini", "entropy"],
+            "max_depth": [None, 2, 3, 4, 5],
+            "min_samples_leaf": [1, 2, 5],
+            "random_state": [42],
+        },
+    ),
+}
+
+
+def prepare_data(df):
+    """Splits the iris data into feature values and numeric target values without changing the DataFrame
+
+    Args:
+    df:DataFrame DataFrame containing the iris data, the last column is the species
+
+    Returns:
+    X:ndarray feature values (sepal length, sepal width, petal length, petal width)
+    y:ndarray species encoded as 0, 1, 2 in alphabetical order
+    """
+    X = df.iloc[:, 0:-1].values
+    # Convert categorical data to numeric
+    y = LabelEncoder().fit_transform(df.iloc[:, -1])
+    return X, y
 
 
 def create_model(df, alg, pickle_file):
@@ -27,15 +72,8 @@ def create_model(df, alg, pickle_file):
 
     """
 
-    # Convert categorical data to numeric
-    le = LabelEncoder()
-    df["species"] = le.fit_transform(df["species"])
-
-    # X = feature values (case sepal length, sepal width, petal length, petal width)
-    X = df.iloc[:, 0:-1]
-    X = X.values
-    # y = target values, last column of the data frame
-    y = df.iloc[:, -1]
+    # X = feature values, y = target values (type of iris)
+    X, y = prepare_data(df)
 
     # Split the data into 80% training and 20% testing (type of iris)
     x_train, x_test, y_train, y_test = train_test_split(
@@ -59,19 +97,93 @@ def create_model(df, alg, pickle_file):
     pickle.dump(model, open(pickle_file, "wb"))
 
 
-def main():
-    """Create the models and serialise them."""
-    iris_file = Path(__file__).parent.joinpath("iris.csv")
-    iris_data = pd.read_csv(iris_file)
+def evaluate_candidate(candidate):
+    """Scores one algorithm and set of hyperparameters using k-fold cross validation
+
+    This runs in a worker process so it takes a single picklable tuple.
+
+    Args:
+    candidate:tuple (name, algorithm class, hyperparameters dict, X, y, number of folds)
+
+    Returns:
+    dict with the name, hyperparameters, mean and standard deviation of the accuracy and the mean fit time in seconds
+    """
+    name, alg, params, X, y, folds = candidate
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=42)
+    scores = cross_validate(alg(**params), X, y, cv=cv, scoring="accuracy")
+    return {
+        "name": name,
+        "params": params,
+        "accuracy": scores["test_score"].mean(),
+        "accuracy_std": scores["test_score"].std(),
+        "fit_time": scores["fit_time"].mean(),
+    }
 
-    model_dt = DecisionTreeClassifier()
-    model_lr = LogisticRegression()
 
-    pickle_file_dt = Path(__file__).parent.joinpath("model_dt.pkl")
-    pickle_file_lr = Path(__file__).parent.joinpath("model_lr.pkl")
+def train_models(df, candidates=CANDIDATES, folds=5, workers=None):
+    """Evaluates every algorithm and hyperparameter combination in parallel and fits the best of each algorithm
 
-    create_model(iris_data, model_dt, pickle_file_dt)
-    create_model(iris_data, model_lr, pickle_file_lr)
+    Args:
+    df:DataFrame DataFrame containing the iris data
+    candidates:dict name to (algorithm class, hyperparameter grid)
+    folds:int number of cross validation folds
+    workers:int number of worker processes, defaults to the number of CPUs
+
+    Returns:
+    results:DataFrame one row per candidate, best first
+    best_models:dict name to the best model for that algorithm, fitted on all the data
+    """
+    X, y = prepare_data(df)
+    jobs = [
+        (name, alg, params, X, y, folds)
+        for name, (alg, grid) in candidates.items()
+        for params in ParameterGrid(grid)
+    ]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(evaluate_candidate, jobs))
+
+    results = pd.DataFrame(results).sort_values(
+        ["accuracy", "fit_time"], ascending=[False, True]
+    )
+    best_models = {}
+    for name, (alg, _) in candidates.items():
+        best = results[results["name"] == name].iloc[0]
+        best_models[name] = alg(**best["params"]).fit(X, y)
+    return results.reset_index(drop=True), best_models
+
+
+def save_model(model, pickle_file):
+    """Pickles the model to a temporary file and then renames it, so a running app never reads a half written file"""
+    temp_file = pickle_file.with_suffix(".tmp")
+    with open(temp_file, "wb") as f:
+        pickle.dump(model, f)
+    os.replace(temp_file, pickle_file)
+
+
+def main():
+    """Find the best model for each algorithm and serialise them. Run with: python -m iris_app.data.create_ml_model"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("--folds", type=int, default=5, help="cross validation folds")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes, defaults to the number of CPUs")
+    args = parser.parse_args()
+
+    data_folder = Path(__file__).parent
+    iris_data = pd.read_csv(data_folder.joinpath("iris.csv"))
+
+    results, best_models = train_models(iris_data, folds=args.folds, workers=args.workers)
+    print(results.to_string())
+    results.to_csv(data_folder.joinpath("training_results.csv"), index=False)
+
+    # The iris app reloads the models when these files change. The pickle is kept for use with scikit-learn, the app
+    # uses the artifact folder of .npy arrays which its worker processes memory-map and share.
+    for name, model in best_models.items():
+        save_model(model, data_folder.joinpath(f"model_{name}.pkl"))
+        save_artifact(compile_model(model), data_folder.joinpath(f"model_{name}"))
+
+    # The overall winner
+    winner = results.iloc[0]["name"]
+    save_model(best_models[winner], data_folder.joinpath("model_best.pkl"))
+    print(f"Best model: {winner} {results.iloc[0]['params']} accuracy {results.iloc[0]['accuracy']:.3f}")
 
 
 if __name__ == "__main__":
@@ -1,16 +1,207 @@
 from pathlib import Path
+import argparse
+from collections import Counter
+import hashlib
+import sqlite3
+import tempfile
+import time
+import numpy as np
 import pandas as pd
-from sqlalchemy import create_engine
 
-# Define the database file name and location
+# Define the default database and data file names and locations
 db_file = Path(__file__).parent.joinpath("iris.db")
+iris_file = Path(__file__).parent.joinpath("iris.csv")
 
-# Create a connection to file as a SQLite database (this automatically creates the file if it doesn't exist)
-engine = create_engine("sqlite:///" + str(db_file), echo=False)
+COLUMNS = ["sepal_length", "sepal_width", "petal_length", "petal_width", "species"]
+
+# The iris table, as previously created by pandas to_sql, uses the SQLite rowid as its primary key
+create_iris_table = """CREATE TABLE IF NOT EXISTS iris (
+    sepal_length FLOAT,
+    sepal_width FLOAT,
+    petal_length FLOAT,
+    petal_width FLOAT,
+    species TEXT);"""
+
+# Hashes of the rows that have been loaded, used to skip them when the loader is run again
+create_load_table = """CREATE TABLE IF NOT EXISTS iris_load (
+    row_hash BLOB PRIMARY KEY) WITHOUT ROWID;"""
+
+create_staging_table = """CREATE TEMP TABLE IF NOT EXISTS iris_staging (
+    row_hash BLOB,
+    sepal_length FLOAT,
+    sepal_width FLOAT,
+    petal_length FLOAT,
+    petal_width FLOAT,
+    species TEXT);"""
+
+# Copy the rows of a chunk that have not been loaded before, then record their hashes
+insert_new_rows = """INSERT INTO iris (sepal_length, sepal_width, petal_length, petal_width, species)
+    SELECT sepal_length, sepal_width, petal_length, petal_width, species FROM iris_staging
+    WHERE NOT EXISTS (SELECT 1 FROM iris_load WHERE iris_load.row_hash = iris_staging.row_hash)
+    ORDER BY iris_staging.rowid;"""
+record_loaded_rows = "INSERT OR IGNORE INTO iris_load (row_hash) SELECT row_hash FROM iris_staging;"
+
+
+def row_hashes(rows, seen):
+    """Returns a hash of the values of each row and the number of times the same values were seen before
+
+    The occurrence count is included so that two flowers with the same measurements are both loaded, it does not
+    depend on where the row is in the file, so adding or moving rows does not load the other rows again.
+
+    Args:
+    rows: iterable of tuples of the values in COLUMNS
+    seen: Counter of the number of times each row has been seen, updated as the rows are hashed
+    """
+    hashes = []
+    for values in rows:
+        text = "%r|%r|%r|%r|%r" % values
+        seen[text] += 1
+        occurrence = f"{text}|{seen[text]}"
+        hashes.append(hashlib.blake2b(occurrence.encode(), digest_size=16).digest())
+    return hashes
+
+
+def prepare_database(connection):
+    """Creates the tables if needed and records the rows of a database loaded before the load table existed
+
+    Rows loaded by the previous version of this script are counted in rowid order, which is the order of the csv file.
+    """
+    connection.execute(create_iris_table)
+    is_new_load_table = (
+        connection.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'iris_load'"
+        ).fetchone()
+        is None
+    )
+    connection.execute(create_load_table)
+    connection.execute(create_staging_table)
+    if is_new_load_table:
+        existing = connection.execute(f"SELECT {', '.join(COLUMNS)} FROM iris ORDER BY rowid")
+        connection.executemany(
+            "INSERT OR IGNORE INTO iris_load (row_hash) VALUES (?)",
+            ((row_hash,) for row_hash in row_hashes(existing, Counter())),
+        )
+
+
+def load_csv(csv_file, database, chunksize=10000, journal_mode=None, synchronous="OFF"):
+    """Loads the rows of the iris csv file that are not already in the database
+
+    The file is read in chunks and every chunk is inserted with executemany, all inside one transaction.
+    Running the loader again with the same file does not add any rows. A row is loaded once for each time its values
+    appear in the file, so a file with rows added anywhere in it only loads the added rows.
+
+    Args:
+    csv_file: csv file with a header row and the columns in COLUMNS
+    database: SQLite database file
+    chunksize: number of csv rows read and inserted at a time
+    journal_mode: SQLite journal mode used while loading, e.g. WAL, the database's own mode is put back afterwards.
+        None keeps the database's mode.
+    synchronous: SQLite synchronous setting used while loading
+
+    Returns:
+    tuple: number of rows loaded, number of rows skipped
+    """
+    # isolation_level=None lets the transaction be controlled with BEGIN and COMMIT
+    connection = sqlite3.connect(database, isolation_level=None)
+    # The journal mode is saved in the database file, so it is only changed for the load
+    original_journal_mode = connection.execute("PRAGMA journal_mode").fetchone()[0]
+    if journal_mode:
+        connection.execute(f"PRAGMA journal_mode = {journal_mode}")
+    connection.execute(f"PRAGMA synchronous = {synchronous}")
+    connection.execute("PRAGMA temp_store = MEMORY")
+    connection.execute("PRAGMA cache_size = -65536")
+
+    loaded = skipped = 0
+    try:
+        connection.execute("BEGIN")
+        prepare_database(connection)
+        chunks = pd.read_csv(
+            csv_file, usecols=COLUMNS, chunksize=chunksize, encoding="utf-8-sig"
+        )
+        seen = Counter()
+        for chunk in chunks:
+            values = list(zip(*(chunk[name].tolist() for name in COLUMNS)))
+            rows = [
+                (row_hash, *row) for row_hash, row in zip(row_hashes(values, seen), values)
+            ]
+            connection.execute("DELETE FROM iris_staging")
+            connection.executemany(
+                "INSERT INTO iris_staging VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            inserted = connection.execute(insert_new_rows).rowcount
+            connection.execute(record_loaded_rows)
+            loaded += inserted
+            skipped += len(rows) - inserted
+        connection.execute("COMMIT")
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+    finally:
+        if journal_mode:
+            connection.execute(f"PRAGMA journal_mode = {original_journal_mode}")
+        connection.close()
+    return loaded, skipped
+
+
+def benchmark(sizes, chunksize):
+    """Times loading synthetic iris data of each size into an empty database, and loading it again"""
+    iris = pd.read_csv(iris_file, encoding="utf-8-sig")
+    rng = np.random.default_rng(42)
+    with tempfile.TemporaryDirectory() as folder:
+        for size in sizes:
+            csv_file = Path(folder, f"iris_{size}.csv")
+            database = Path(folder, f"iris_{size}.db")
+            # Sample rows from the iris data and add noise at the 0.1 cm resolution of the measurements
+            data = iris.sample(size, replace=True, random_state=42).reset_index(drop=True)
+            noise = rng.integers(-2, 3, size=(size, 4)) / 10
+            data.iloc[:, 0:4] = (data.iloc[:, 0:4] + noise).round(1)
+            data.to_csv(csv_file, index=False)
+
+            for run in ("first load", "reload"):
+                start = time.perf_counter()
+                loaded, skipped = load_csv(csv_file, database, chunksize, "WAL")
+                seconds = time.perf_counter() - start
+                print(
+                    f"{size:>10} rows, {run}: {loaded} loaded, {skipped} skipped "
+                    f"in {seconds:.1f}s ({size / seconds:,.0f} rows/sec)"
+                )
+
+
+def main():
+    """Load the iris csv data into the SQLite database, skipping rows that have already been loaded."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument("csv_file", nargs="?", default=iris_file, help="csv file to load")
+    parser.add_argument("--database", default=db_file, help="SQLite database file")
+    parser.add_argument("--chunksize", type=int, default=10000, help="rows read and inserted at a time")
+    parser.add_argument(
+        "--journal-mode",
+        choices=["DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"],
+        help="SQLite journal mode used while loading, the database's own mode is put back afterwards",
+    )
+    parser.add_argument(
+        "--synchronous",
+        default="OFF",
+        choices=["OFF", "NORMAL", "FULL", "EXTRA"],
+        help="SQLite synchronous setting used while loading",
+    )
+    parser.add_argument(
+        "--benchmark",
+        type=int,
+        nargs="+",
+        metavar="ROWS",
+        help="time loading synthetic data of these sizes into a temporary database instead, e.g. 1000000 10000000",
+    )
+    args = parser.parse_args()
+
+    if args.benchmark:
+        benchmark(args.benchmark, args.chunksize)
+        return
+
+    loaded, skipped = load_csv(
+        args.csv_file, args.database, args.chunksize, args.journal_mode, args.synchronous
+    )
+    print(f"Loaded {loaded} rows, skipped {skipped} rows that were already loaded")
 
-# Read the iris data to a pandas dataframe
-iris_file = Path(__file__).parent.joinpath("iris.csv")
-iris = pd.read_csv(iris_file)
 
-# Write the data to a table in the sqlite database (data/iris.db)
-iris.to_sql("iris", engine, if_exists="append", index=False)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def client(host, port, request, count, latencies, errors):
+    """Sends the request count times, one after the other, on a keep-alive connection
+
+    If the server closes the connection after a response, e.g. a WSGI server without keep-alive, a new connection is
+    opened for the next request and the time to connect is included in its latency.
+    """
+    writer = None
+    try:
+        for _ in range(count):
+            start = time.perf_counter()
+            if writer is None:
+                reader, writer = await asyncio.open_connection(host, port)
+            writer.write(request)
+            status_line = await reader.readline()
+            length = 0
+            keep_alive = True
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                name, _, value = line.decode("latin-1").partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+                elif name.lower() == "connection" and value.strip().lower() == "close":
+                    keep_alive = False
+            await reader.readexactly(length)
+            latencies.append(time.perf_counter() - start)
+            if status_line.split()[1:2] != [b"200"]:
+                errors.append(status_line.decode("latin-1").strip())
+            if not keep_alive:
+                writer.close()
+                writer = None
+    except (OSError, asyncio.IncompleteReadError, IndexError):
+        errors.append("connection closed")
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+async def run(url, connections, requests):
+    parts = urlsplit(url)
+    path = parts.path + (f"?{parts.query}" if parts.query else "")
+    request = (
+        f"GET {path} HTTP/1.1\r\nHost: {parts.netloc}\r\nConnection: keep-alive\r\n\r\n"
+    ).encode()
+    latencies, errors = [], []
+    start = time.perf_counter()
+    await asyncio.gather(
+        *(
+            client(parts.hostname, parts.port or 80, request, requests, latencies, errors)
+            for _ in range(connections)
+        )
+    )
+    return time.perf_counter() - start, latencies, errors
+
+
+def main():
+    """Load test a running iris app with many concurrent keep-alive connections, e.g. to compare the WSGI and ASGI
+    servers. Each connection sends its requests one after the other."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument(
+        "url",
+        nargs="?",
+        default="http://127.0.0.1:5000/predict?sep-len=5.1&sep-wid=3.5&pet-len=1.4&pet-wid=0.2",
+        help="URL to request",
+    )
+    parser.add_argument("--connections", type=int, default=1000, help="concurrent connections")
+    parser.add_argument("--requests", type=int, default=20, help="requests sent on each connection")
+    args = parser.parse_args()
+
+    seconds, latencies, errors = asyncio.run(run(args.url, args.connections, args.requests))
+    if not latencies:
+        print(f"No responses, {len(errors)} errors")
+        return
+    centiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    print(
+        f"{len(latencies)} responses in {seconds:.1f}s ({len(latencies) / seconds:,.0f} requests/sec), "
+        f"{len(errors)} errors"
+    )
+    print(
+        f"latency p50 {centiles[49] * 1000:.1f}ms, p95 {centiles[94] * 1000:.1f}ms, "
+        f"p99 {centiles[98] * 1000:.1f}ms, max {max(latencies) * 1000:.1f}ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+import math
+import queue
+import threading
+import time
+from concurrent.futures import Future
+import numpy as np
+
+
+class MicroBatcher:
+    """Collects single-row predictions from concurrent requests and scores them together.
+
+    Each model has a worker thread. The worker waits for the first row, then keeps collecting rows until the batch
+    window has passed or the batch is full, scores all the rows with one call to the model and hands each request
+    its own result. A request waits at most the batch window plus the time to score one batch.
+    """
+
+    def __init__(self, app=None):
+        self.enabled = False
+        self.window = 0.002
+        self.max_rows = 64
+        self.batches = 0
+        self.rows = 0
+        self._queues = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the batcher from the app config
+
+        IRIS_MICROBATCH_ENABLED turns batching on, IRIS_MICROBATCH_WINDOW is the number of seconds to wait for more
+        rows and IRIS_MICROBATCH_MAX_ROWS is the largest number of rows scored together.
+        """
+        self.enabled = app.config.get("IRIS_MICROBATCH_ENABLED", False)
+        self.window = app.config.get("IRIS_MICROBATCH_WINDOW", 0.002)
+        self.max_rows = app.config.get("IRIS_MICROBATCH_MAX_ROWS", 64)
+        app.extensions["micro_batcher"] = self
+
+    def predict(self, model_name, flower_values, predict_batch):
+        """Adds one row to the next batch for the model and waits for its prediction
+
+        Parameters:
+        model_name (str): Name of the model, rows for different models are batched separately
+        flower_values (List): List of sepal length, sepal width, petal length, petal width
+        predict_batch (function): Called as predict_batch(features, model_name) with a 2D array of rows
+
+        Returns:
+        variety (str): Name of the predicted iris variety
+        """
+        row = [float(value) for value in flower_values]
+        # Reject bad values here so they cannot make the whole batch fail
+        if len(row) != 4 or not all(math.isfinite(value) for value in row):
+            raise ValueError(f"Invalid flower values: {flower_values}")
+        future = Future()
+        self._queue_for(model_name, predict_batch).put((row, future))
+        return future.result()
+
+    def stats(self):
+        """Returns the number of batches and rows scored and the mean batch size as a dict"""
+        return {
+            "batches": self.batches,
+            "rows": self.rows,
+            "mean_batch_size": self.rows / self.batches if self.batches else 0.0,
+        }
+
+    def _queue_for(self, model_name, predict_batch):
+        requests = self._queues.get(model_name)
+        if requests is None:
+            with self._lock:
+                requests = self._queues.get(model_name)
+                if requests is None:
+                    requests = queue.SimpleQueue()
+                    threading.Thread(
+                        target=self._run,
+                        args=(model_name, predict_batch, requests),
+                        name=f"micro-batcher-{model_name}",
+                        daemon=True,
+                    ).start()
+                    self._queues[model_name] = requests
+        return requests
+
+    def _run(self, model_name, predict_batch, requests):
+        while True:
+            row, future = requests.get()
+            rows, futures = [row], [future]
+            deadline = time.monotonic() + self.window
+            while len(rows) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row, future = requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                rows.append(row)
+                futures.append(future)
+
+            try:
+                predictions = predict_batch(np.asarray(rows, dtype=float), model_name)
+            except Exception as err:
+                for future in futures:
+                    future.set_exception(err)
+                continue
+            self.batches += 1
+            self.rows += len(rows)
+            for future, prediction in zip(futures, predictions):
+                future.set_result(str(prediction))
@@ -0,0 +1,182 @@
+import logging
+import pickle
+import threading
+import time
+from collections import namedtuple
+
+
+# A model that has been loaded from disk, along with the file details used to detect when it changes
+LoadedModel = namedtuple("LoadedModel", ["model", "mtime_ns", "size", "version"])
+
+logger = logging.getLogger(__name__)
+
+
+class ModelRegistry:
+    """Loads the pickled iris models when they are first used and reloads them when the file changes.
+
+    Each process keeps its own copy of each model. Requests always get the current model without waiting: when a
+    newer pickle is found on disk it is loaded in a background thread and swapped in once it has loaded, until then
+    the previous model carries on serving requests.
+    """
+
+    def __init__(self, app=None):
+        self.paths = {}
+        self.default = None
+        self.check_interval = 2.0
+        self.compiled = False
+        self._models = {}
+        self._last_checked = {}
+        self._reloading = set()
+        self._listeners = []
+        self._load_locks = {}
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Registers the models listed in the app config
+
+        IRIS_MODELS is a dict of model name to pickle file or artifact folder written by save_artifact, the arrays in
+        an artifact folder are memory-mapped so they are shared by all the worker processes. IRIS_DEFAULT_MODEL is the name used when a request does not
+        give one and IRIS_MODEL_CHECK_INTERVAL is the number of seconds between checks for a newer file.
+        If IRIS_INFERENCE_MODE is "compiled" the models are converted to their NumPy versions when they are loaded,
+        tests/test_compiled_models.py checks that they give exactly the same predictions as scikit-learn.
+        """
+        for name, path in app.config["IRIS_MODELS"].items():
+            self.register(name, path)
+        self.default = app.config.get("IRIS_DEFAULT_MODEL", next(iter(self.paths)))
+        self.check_interval = app.config.get("IRIS_MODEL_CHECK_INTERVAL", 2.0)
+        self.compiled = app.config.get("IRIS_INFERENCE_MODE") == "compiled"
+        app.extensions["model_registry"] = self
+
+    def register(self, name, path):
+        """Adds a model to the registry, it is not loaded until it is first used"""
+        with self._lock:
+            self.paths[name] = path
+            self._models.pop(name, None)
+
+    def add_listener(self, callback):
+        """Calls callback(name, version) whenever a model is reloaded from a newer file"""
+        self._listeners.append(callback)
+
+    def __contains__(self, name):
+        return name in self.paths
+
+    def get(self, name=None):
+        """Returns the model with the given name, or the default model
+
+        Raises:
+        KeyError: if no model is registered with that name
+        """
+        return self.get_loaded(name).model
+
+    def get_loaded(self, name=None):
+        """Returns the LoadedModel for the given name, loading it if this is the first time it has been used"""
+        name = name or self.default
+        loaded = self._models.get(name)
+        if loaded is None:
+            # Each model has its own lock, so loading one model does not hold up requests for the others
+            with self._load_lock(name):
+                # Another thread may have loaded it while this one waited for the lock
+                loaded = self._models.get(name) or self._load(name)
+            return loaded
+
+        now = time.monotonic()
+        if now - self._last_checked.get(name, 0) >= self.check_interval:
+            self._last_checked[name] = now
+            self._reload_if_changed(name, loaded)
+        return loaded
+
+    def version(self, name=None):
+        """Returns the version number of the loaded model, this increases every time the model is reloaded"""
+        return self.get_loaded(name).version
+
+    def warm_up(self):
+        """Loads every registered model in a background thread so the first requests do not wait for them"""
+        thread = threading.Thread(
+            target=self._load_all, name="model-registry-warm-up", daemon=True
+        )
+        thread.start()
+        return thread
+
+    def _load_lock(self, name):
+        lock = self._load_locks.get(name)
+        if lock is None:
+            with self._lock:
+                lock = self._load_locks.setdefault(name, threading.Lock())
+        return lock
+
+    def _load_all(self):
+        for name in list(self.paths):
+            try:
+                self.get_loaded(name)
+            except Exception as err:
+                # The model will be loaded again, and the error raised, when a request uses it
+                logger.warning("Could not load model %s: %s", name, err)
+
+    def _load(self, name, previous=None):
+        path = self.paths[name]
+        stat = self._watched_file(path).stat()
+        if path.is_dir():
+            # Imported when the first model is loaded, the model code is kept out of starting the app
+            from iris_app.compiled_models import load_artifact
+
+            model = load_artifact(path)
+        else:
+            with open(path, "rb") as pickle_file:
+                model = pickle.load(pickle_file)
+            if self.compiled:
+                model = self._compile(name, model)
+        version = previous.version + 1 if previous else 1
+        loaded = LoadedModel(model, stat.st_mtime_ns, stat.st_size, version)
+        # Replacing the dict entry is atomic so readers see either the old or the new model, never a partial one
+        self._models[name] = loaded
+        self._last_checked[name] = time.monotonic()
+        if previous:
+            for callback in self._listeners:
+                callback(name, version)
+        return loaded
+
+    def _compile(self, name, model):
+        """Returns the compiled version of the model, or the model itself if there is no compiled version"""
+        from iris_app.compiled_models import compile_model
+
+        try:
+            return compile_model(model)
+        except TypeError as err:
+            logger.warning("Using the scikit-learn model for %s: %s", name, err)
+            return model
+
+    @staticmethod
+    def _watched_file(path):
+        """Returns the file that changes when a new version of the model is saved"""
+        return path.joinpath("manifest.json") if path.is_dir() else path
+
+    def _reload_if_changed(self, name, loaded):
+        try:
+            stat = self._watched_file(self.paths[name]).stat()
+        except OSError:
+            # The file is being replaced, keep serving the current model
+            return
+        if (stat.st_mtime_ns, stat.st_size) == (loaded.mtime_ns, loaded.size):
+            return
+        with self._lock:
+            if name in self._reloading:
+                return
+            self._reloading.add(name)
+        threading.Thread(
+            target=self._background_reload,
+            args=(name, loaded),
+            name=f"model-registry-reload-{name}",
+            daemon=True,
+        ).start()
+
+    def _background_reload(self, name, previous):
+        try:
+            # No lock is held while the new model loads, requests carry on using the previous one until it is swapped in
+            self._load(name, previous)
+        except Exception as err:
+            # The pickle may be part way through being written, keep the current model and try again at the next check
+            logger.warning("Could not reload model %s: %s", name, err)
+        finally:
+            self._reloading.discard(name)
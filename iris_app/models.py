@@ -1,6 +1,6 @@
-from iris_app import db
+from iris_app import db, user_cache, password_hasher
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy import event
 
 
 class Iris(db.Model):
@@ -34,16 +34,18 @@ class User(UserMixin, db.Model):
     def __init__(self, email: str, password: str):
         """
         Create a new User object hashing the plain text password.
+
+        The password is hashed on the password hashing pool, which raises HashingBusyError if the pool is full.
         """
         self.email = email
-        self.password = generate_password_hash(password)
+        self.password = password_hasher.generate_password_hash(password)
 
     def check_password(self, password):
         """Check the plain text password matches the hashed password
 
         :return Boolean:
         """
-        return check_password_hash(self.password, password)
+        return password_hasher.check_password_hash(self.password, password)
 
     def __repr__(self):
         """
@@ -52,3 +54,10 @@ class User(UserMixin, db.Model):
         """
         clsname = self.__class__.__name__
         return f"{clsname}: <{self.id}, {self.email}>"
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def remove_cached_user(mapper, connection, user):
+    """Removes a user from the user cache when their email or password is changed or they are deleted"""
+    user_cache.invalidate(user.id)
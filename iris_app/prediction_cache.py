@@ -0,0 +1,39 @@
+from app_common.cache import LRUCache
+
+
+class PredictionCache(LRUCache):
+    """Cache of predictions, keyed on the flower values rounded to the measurement resolution.
+
+    Entries expire after a time to live and the whole cache is cleared when a model is reloaded. The key also includes
+    the model version, so a prediction made by an old model can never be returned after a reload.
+    """
+
+    def __init__(self, app=None):
+        super().__init__()
+        self.scale = 10
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the cache from the app config
+
+        IRIS_PREDICTION_CACHE_SIZE is the maximum number of entries (0 turns the cache off), IRIS_PREDICTION_CACHE_TTL
+        is the number of seconds an entry is kept and IRIS_PREDICTION_CACHE_RESOLUTION is the measurement resolution
+        in cm that values are rounded to.
+        """
+        self.maxsize = app.config.get("IRIS_PREDICTION_CACHE_SIZE", 10000)
+        self.ttl = app.config.get("IRIS_PREDICTION_CACHE_TTL", 3600.0)
+        self.scale = round(1 / app.config.get("IRIS_PREDICTION_CACHE_RESOLUTION", 0.1))
+        app.extensions["prediction_cache"] = self
+
+    def quantize(self, flower_values):
+        """Rounds the flower values to whole multiples of the resolution
+
+        Returns:
+        tuple: The values as integer multiples of the resolution, e.g. (51, 35, 14, 2) for [5.1, 3.5, 1.4, 0.2]
+        """
+        return tuple(round(float(value) * self.scale) for value in flower_values)
+
+    def values(self, quantized):
+        """Converts a quantized tuple back to the flower values in cm"""
+        return [value / self.scale for value in quantized]
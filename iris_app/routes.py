@@ -1,7 +1,9 @@
-from pathlib import Path
 from datetime import timedelta
 from urllib.parse import urlparse, urljoin
-import pickle
+import csv
+import io
+import time
+import numpy as np
 from flask import (
     render_template,
     current_app as app,
@@ -10,17 +12,31 @@ from flask import (
     redirect,
     url_for,
     abort,
+    jsonify,
+    make_response,
+    stream_template,
 )
-from flask_login import logout_user, login_required, login_user
-import numpy as np
+from flask_login import logout_user, login_required, login_user, current_user
 from sqlalchemy.exc import IntegrityError, NoResultFound
 from iris_app.forms import LoginForm, PredictionForm, RegisterForm
-from iris_app import db, login_manager
+from iris_app import (
+    db,
+    login_manager,
+    metrics,
+    micro_batcher,
+    model_registry,
+    prediction_cache,
+    user_cache,
+)
 from iris_app.models import Iris, User
+from app_common.password_hashing import HashingBusyError
+
 
+# Names of the features in the order the model expects them
+FEATURE_NAMES = ["sepal_length", "sepal_width", "petal_length", "petal_width"]
 
-pickle_file = Path(__file__).parent.joinpath("data", "model_lr.pkl")
-IRIS_MODEL = pickle.load(open(pickle_file, "rb"))
+# Iris varieties indexed by the numeric label the model predicts (see LabelEncoder in create_ml_model.py)
+VARIETIES = ("iris-setosa", "iris-versicolor", "iris-virginica")
 
 
 @app.route("/", methods=["GET", "POST"])
@@ -54,10 +70,14 @@ def predict():
     """Predict iris species
 
     Takes the arguments sepal_length,sepal_width,petal_length,petal_width  from an HTTP request. Passes the arguments to the model and returns a prediction (classification of Iris species).
+    The optional argument model chooses which of the registered models to use.
 
     Returns:
         species(str): A string of the iris species.
     """
+    model_name = request.args.get("model")
+    if model_name is not None and model_name not in model_registry:
+        return bad_request(f"Unknown model: {model_name}")
 
     sepal_length = request.args.get("sep-len")
     sepal_width = request.args.get("sep-wid")
@@ -65,40 +85,203 @@ def predict():
     petal_width = request.args.get("pet-wid")
 
     prediction = make_prediction(
-        [sepal_length, sepal_width, petal_length, petal_width]
+        [sepal_length, sepal_width, petal_length, petal_width], model_name
     )
 
     return prediction
 
 
-def make_prediction(flower_values):
+@app.post("/predict/batch")
+def predict_batch():
+    """Predict iris species for many flowers in one request
+
+    Accepts either a JSON array in the request body or a CSV file uploaded in the 'file' field.
+    Each JSON row is a list of the four feature values, or an object keyed by the feature names.
+    A CSV file needs a header row that names the four feature columns, other columns are ignored.
+    The optional argument model chooses which of the registered models to use.
+
+    Returns:
+        JSON object with a list of predicted species in the same order as the rows.
+    """
+    model_name = request.args.get("model")
+    if model_name is not None and model_name not in model_registry:
+        return bad_request(f"Unknown model: {model_name}")
+
+    try:
+        if "file" in request.files:
+            rows = read_csv_features(request.files["file"])
+        else:
+            rows = read_json_features(request.get_json(silent=True))
+        features = np.asarray(rows, dtype=float)
+        if features.ndim != 2 or features.shape[1] != len(FEATURE_NAMES):
+            raise ValueError(f"Each row must have {len(FEATURE_NAMES)} values")
+    except (KeyError, TypeError, ValueError) as err:
+        return bad_request(f"Invalid flower values: {err}")
+
+    predictions = make_predictions(features, model_name)
+    return {"predictions": predictions.tolist()}
+
+
+@app.get("/predict/cache")
+def predict_cache():
+    """Returns the prediction cache hit, miss and eviction counters as JSON"""
+    return prediction_cache.stats()
+
+
+def bad_request(text):
+    """Returns a JSON response with status code 400 and the given message"""
+    message = jsonify(
+        {
+            "status": 400,
+            "error": "Bad request",
+            "message": text,
+        }
+    )
+    return make_response(message, 400)
+
+
+def read_json_features(rows):
+    """Converts the rows of a JSON array to lists of feature values in the order the model expects
+
+    Parameters:
+    rows (List): List of lists of four values, or of dicts keyed by the feature names
+
+    Returns:
+    features (List): List of lists of sepal length, sepal width, petal length, petal width
+    """
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("Expected a non-empty JSON array")
+    return [
+        [row[name] for name in FEATURE_NAMES] if isinstance(row, dict) else row
+        for row in rows
+    ]
+
+
+def read_csv_features(csv_file):
+    """Reads the feature columns from an uploaded CSV file
+
+    Parameters:
+    csv_file (FileStorage): Uploaded CSV file with a header row naming the feature columns
+
+    Returns:
+    features (List): List of lists of sepal length, sepal width, petal length, petal width
+    """
+    # utf-8-sig removes the byte order mark that Excel adds, e.g. as in data/iris.csv
+    text = io.TextIOWrapper(csv_file.stream, encoding="utf-8-sig")
+    reader = csv.DictReader(text)
+    rows = [[row[name] for name in FEATURE_NAMES] for row in reader]
+    if not rows:
+        raise ValueError("The CSV file has no rows")
+    return rows
+
+
+def make_prediction(flower_values, model_name=None):
     """Takes the flower values, makes a model using the prediction and returns a string of the predicted flower variety
 
     Parameters:
     flower_values (List): List of sepal length, sepal width, petal length, petal width
+    model_name (str): Name of the model in the model registry, uses the default model if None
 
     Returns:
     variety (str): Name of the predicted iris variety
     """
+    if not prediction_cache.enabled:
+        return score_flower(flower_values, model_name)
+
+    # Repeat queries are answered from the cache without building an array or calling the model.
+    # The model version is part of the key so a reloaded model is never answered with an old prediction.
+    model_name = model_name or model_registry.default
+    quantized = prediction_cache.quantize(flower_values)
+    key = (model_name, model_registry.version(model_name), quantized)
+    variety = prediction_cache.get(key)
+    if variety is None:
+        # Predict from the rounded values so every value that shares the key gets the same prediction
+        variety = score_flower(prediction_cache.values(quantized), model_name)
+        prediction_cache.put(key, variety)
+
+    return variety
+
+
+def score_flower(flower_values, model_name=None):
+    """Gets the prediction for one flower from the model, through the micro-batcher if it is turned on
+
+    Parameters:
+    flower_values (List): List of sepal length, sepal width, petal length, petal width
+    model_name (str): Name of the model in the model registry, uses the default model if None
+
+    Returns:
+    variety (str): Name of the predicted iris variety
+    """
+    if micro_batcher.enabled:
+        return micro_batcher.predict(
+            model_name or model_registry.default, flower_values, make_predictions
+        )
 
     # Convert to a 2D numpy array with float values, needed as input to the model
     input_values = np.asarray([flower_values], dtype=float)
 
-    # Get a prediction from the model
-    prediction = IRIS_MODEL.predict(input_values)
+    # Get a prediction from the model and convert it to the variety name
+    return str(make_predictions(input_values, model_name)[0])
 
-    # convert the prediction to the variety name
-    varieties = {0: "iris-setosa", 1: "iris-versicolor", 2: "iris-virginica"}
-    variety = np.vectorize(varieties.__getitem__)(prediction[0])
 
-    return variety
+def make_predictions(features, model_name=None):
+    """Predicts the iris variety for every row of a 2D array of flower values
+
+    The whole array is scored with a single call to the model and the numeric labels are converted to names by
+    indexing an array of the VARIETIES, so the cost per row stays low for large batches.
+
+    Parameters:
+    features (ndarray): Array of shape (n, 4) of sepal length, sepal width, petal length, petal width
+    model_name (str): Name of the model in the model registry, uses the default model if None
+
+    Returns:
+    varieties (ndarray): Array of the n predicted iris variety names
+    """
+    model_name = model_name or model_registry.default
+    model = model_registry.get(model_name)
+    start = time.perf_counter()
+    prediction = model.predict(features)
+    metrics.observe("iris_inference_seconds", time.perf_counter() - start, model=model_name)
+    metrics.inc("iris_rows_scored_total", len(features), model=model_name)
+    return np.take(VARIETIES, prediction.astype(int))
 
 
 @app.route("/iris")
 def iris_list():
-    """Render page with a list of all the iris entries from the database"""
-    iris = db.session.execute(db.select(Iris)).scalars()
-    return render_template("iris.html", iris_list=iris)
+    """Render page with a list of the iris entries from the database
+
+    Pages are selected with keyset pagination on rowid: the argument after is the last rowid of the previous page and
+    size is the number of rows on a page. With the argument stream=1 (or true) the page is sent to the browser as it is rendered
+    and the rows are fetched from the database in chunks, if size is not given all the remaining rows are sent.
+    """
+    after = request.args.get("after", 0, type=int)
+    stream = request.args.get("stream", "").lower() in ("1", "true")
+    default_size = None if stream else app.config["IRIS_PAGE_SIZE"]
+    size = request.args.get("size", default_size, type=int)
+    if size is not None:
+        size = max(1, min(size, app.config["IRIS_MAX_PAGE_SIZE"]))
+
+    query = db.select(Iris).where(Iris.rowid > after).order_by(Iris.rowid)
+    if size is not None:
+        query = query.limit(size)
+
+    if stream:
+        query = query.execution_options(yield_per=app.config["IRIS_STREAM_YIELD_PER"])
+        return stream_template(
+            "iris.html", iris_list=stream_rows(query), page_size=size, stream=True
+        )
+
+    iris = db.session.execute(query).scalars()
+    return render_template("iris.html", iris_list=iris, page_size=size, stream=False)
+
+
+def stream_rows(query):
+    """Yields the objects selected by the query, the query is only run when the first object is needed
+
+    The session used by the view has been closed by the time a streamed response is sent, stream_template pushes the
+    request context again so this runs the query in a new session that stays open until the last row is sent.
+    """
+    yield from db.session.execute(query).scalars()
 
 
 @app.route("/register", methods=["GET", "POST"])
@@ -108,10 +291,15 @@ def register():
     if form.validate_on_submit():
         email = request.form.get("email")
         password = request.form.get("password")
-        new_user = User(email=email, password=password)
+        try:
+            new_user = User(email=email, password=password)
+        except HashingBusyError:
+            flash("The server is busy, please try again")
+            return render_template("register.html", form=form), 503
         try:
             db.session.add(new_user)
             db.session.commit()
+            user_cache.invalidate(new_user.id)
             # Remove to replace with Flash message
             # text = f"<p>You are registered! {repr(new_user)}</p>"
             # return text
@@ -154,6 +342,9 @@ def login():
                 flash("Incorrect password")
         except NoResultFound:
             flash("Email address not found")
+        except HashingBusyError:
+            flash("The server is busy, please try again")
+            return render_template("login.html", title="Login", form=login_form), 503
     return render_template("login.html", title="Login", form=login_form)
 
 
@@ -161,16 +352,19 @@ def login():
 @login_required
 def logout():
     """Logs out a user if logged in and redirects to the home page."""
+    user_cache.invalidate(int(current_user.get_id()))
     logout_user()
     return redirect(url_for("index"))
 
 
 @login_manager.user_loader
 def load_user(user_id):
-    """Takes a user ID and returns a user object or None if the user does not exist"""
+    """Takes a user ID and returns a user object or None if the user does not exist
+
+    The user is read from the user cache, the database is only queried when the user is not in the cache.
+    """
     if user_id is not None:
-        user = db.get_or_404(User, user_id)
-        return user
+        return user_cache.load(user_id, lambda id: db.session.get(User, id))
     return None
 
 
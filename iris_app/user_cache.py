@@ -0,0 +1,62 @@
+from flask_login import UserMixin
+from app_common.cache import LRUCache
+
+
+class CachedUser(UserMixin):
+    """Lightweight copy of a User for Flask-Login, it holds no database session and no password hash"""
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+    def __repr__(self):
+        clsname = self.__class__.__name__
+        return f"{clsname}: <{self.id}, {self.email}>"
+
+
+class UserCache(LRUCache):
+    """Cache of the logged in users, so the Flask-Login user loader does not query the database on every request.
+
+    Entries are removed when a user registers, logs out, or their row in the user table is changed or deleted.
+    """
+
+    def __init__(self, app=None):
+        super().__init__(maxsize=10000, ttl=60.0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the cache from the app config
+
+        IRIS_USER_CACHE_SIZE is the maximum number of users (0 turns the cache off) and IRIS_USER_CACHE_TTL is the
+        number of seconds a user is kept.
+        """
+        self.maxsize = app.config.get("IRIS_USER_CACHE_SIZE", 10000)
+        self.ttl = app.config.get("IRIS_USER_CACHE_TTL", 60.0)
+        app.extensions["user_cache"] = self
+
+    def load(self, user_id, query):
+        """Returns the cached user, or calls query(user_id) and caches the result if it is not None
+
+        Parameters:
+        user_id (str): User id from the Flask-Login session
+        query (function): Returns the User with the id from the database, or None
+
+        Returns:
+        CachedUser or None if the user does not exist or the id is not a number
+        """
+        try:
+            user_id = int(user_id)
+        except (TypeError, ValueError):
+            return None
+        if not self.enabled:
+            user = query(user_id)
+            return CachedUser(user.id, user.email) if user else None
+        user = self.get(user_id)
+        if user is None:
+            user = query(user_id)
+            if user is None:
+                return None
+            user = CachedUser(user.id, user.email)
+            self.put(user_id, user)
+        return user
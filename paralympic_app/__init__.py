@@ -1,22 +1,59 @@
+import os
 from pathlib import Path
 from flask import Flask, render_template
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
-from paralympic_app.paralympic_dash_app.paralympics_dash_app import (
-    create_dash_app,
-)
+from app_common.metrics import Metrics
+from app_common.password_hashing import PasswordHasher
+from app_common.sql_timing import SQLTiming
+from app_common.sqlite_profile import set_sqlite_pragmas
+from paralympic_app.data_versions import DataVersions
+from paralympic_app.read_routing import READ_BIND, ReadRoutingSession, add_read_bind, read_pragmas
+from paralympic_app.token_cache import TokenCache
 
 # Sets the project root folder
 PROJECT_ROOT = Path(__file__).parent
 
-# Create a global SQLAlchemy object
-db = SQLAlchemy()
+# Create a global SQLAlchemy object, its sessions send the reads of GET requests to the read bind
+db = SQLAlchemy(session_options={"class_": ReadRoutingSession})
 # Create a global Flask-Marshmallow object
 ma = Marshmallow()
+# Create the pool that limits how many passwords are hashed at once
+password_hasher = PasswordHasher()
+# Create the registry of request, query and dashboard metrics
+metrics = Metrics()
+# Create the per-request timing of the SQL statements
+sql_timing = SQLTiming()
+# Create the versions of the tables used for the ETag and Last-Modified headers of the API
+data_versions = DataVersions()
+# Create the cache of verified JWTs used by the protected API routes
+token_cache = TokenCache()
 
 
-def create_app():
-    """Create and configure the Flask app"""
+def hashing_metrics():
+    """Returns the counters kept by the password hasher for /metrics"""
+    hashing = password_hasher.stats()
+    return [
+        ("password_hashing_queued", "gauge", {}, hashing["queued"]),
+        ("password_hashing_rejected_total", "counter", {}, hashing["rejected"]),
+    ]
+
+
+def token_cache_metrics():
+    """Returns the counters kept by the token cache for /metrics"""
+    tokens = token_cache.stats()
+    return [
+        ("paralympic_token_cache_hits_total", "counter", {}, tokens["hits"]),
+        ("paralympic_token_cache_misses_total", "counter", {}, tokens["misses"]),
+        ("paralympic_token_cache_entries", "gauge", {}, tokens["size"]),
+    ]
+
+
+def create_app(config=None):
+    """Create and configure the Flask app
+
+    :param config: dict of settings that replace the defaults below, e.g. for a test or benchmark
+    """
     app = Flask(__name__)
     app.config["SECRET_KEY"] = "YY3R4fQ5OmlmVKOSlsVHew"
     # configure the SQLite database location
@@ -24,16 +61,75 @@ def create_app():
         PROJECT_ROOT.joinpath("data", "paralympics.db")
     )
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-    app.config["SQLALCHEMY_ECHO"] = True
+    # SQLite settings for each new connection: readers do not wait for writers with the write-ahead log, commits only
+    # sync at checkpoints, a 16 MB page cache, reads through a 128 MB memory map, and a wait of up to 5 seconds for a lock
+    app.config["SQLITE_PRAGMAS"] = {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -16000,
+        "mmap_size": 134217728,
+        "busy_timeout": 5000,
+        "foreign_keys": "ON",
+    }
+    # Connections kept open for the request threads, up to pool_size + max_overflow at once
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": 10, "max_overflow": 20, "pool_timeout": 10}
+    # GET requests to these blueprints read from the read bind, which cannot write so never takes a write lock
+    app.config["READ_BIND_BLUEPRINTS"] = ("api", "main")
+    # Database of the read bind, e.g. a replica file, None for the main SQLite database opened read-only
+    app.config["READ_BIND_URI"] = None
+    # Statements are timed by sql_timing rather than each one being written to the log
+    app.config["SQLALCHEMY_ECHO"] = False
+    # Statements slower than this many seconds are logged with the route that ran them, None to turn off
+    app.config["SQL_SLOW_QUERY_SECONDS"] = 0.1
+    # Add the number of statements and their total time to each response in a Server-Timing header
+    app.config["SQL_SERVER_TIMING"] = True
+    # Passwords are hashed by at most this many threads at once, further requests wait in a queue of limited size
+    app.config["PASSWORD_HASHING_WORKERS"] = 2
+    app.config["PASSWORD_HASHING_MAX_QUEUE"] = 32
+    app.config["PASSWORD_HASHING_TIMEOUT"] = 10.0
+    # Build the dashboard charts in a background thread once the app is created, rather than on the first visit
+    app.config["DASH_WARM_UP"] = True
+    # Folder shared by the worker processes of a pre-fork server so /metrics covers all of them, None for one process
+    app.config["METRICS_MULTIPROC_DIR"] = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+    app.config["METRICS_FLUSH_INTERVAL"] = 1.0
+    # Largest number of events on a page of /api/event
+    app.config["API_MAX_PAGE_SIZE"] = 1000
+    # How the routes that dump ORM objects load their relationships: "selectin", "joined", "lazy" or "raise"
+    app.config["API_RELATIONSHIP_LOADING"] = {"Event.region": "joined"}
+    # Rows validated and inserted in each transaction by the bulk routes
+    app.config["API_BULK_BATCH_SIZE"] = 1000
+    # Rows fetched from the database and sent at a time by the export routes
+    app.config["API_EXPORT_YIELD_PER"] = 1000
+    # Cache of verified JWTs, a token is checked and its user read from the database again after the TTL in seconds,
+    # when the token expires if that is sooner, or when a user is changed. Tokens last 5 minutes.
+    app.config["API_TOKEN_CACHE_SIZE"] = 10000
+    app.config["API_TOKEN_CACHE_TTL"] = 60.0
+    # Folder of the table version files, next to the database so all the worker processes share it
+    app.config["DATA_VERSION_FOLDER"] = PROJECT_ROOT.joinpath("data", "versions")
+    if config:
+        app.config.update(config)
+    add_read_bind(app)
 
     # Uses a helper function to initialise extensions
     initialize_extensions(app)
 
-    # Creates the User table in the database
+    # Creates the User table and any missing indexes in the database
     with app.app_context():
         from paralympic_app.models import User
 
+        # Apply SQLITE_PRAGMAS to each connection, before the first one is opened
+        set_sqlite_pragmas(db.engine, app.config["SQLITE_PRAGMAS"])
+        if READ_BIND in db.engines:
+            set_sqlite_pragmas(db.engines[READ_BIND], read_pragmas(app.config["SQLITE_PRAGMAS"]))
+        # Count and time the queries run on this app's databases
+        for engine in db.engines.values():
+            metrics.instrument_engine(engine)
+            sql_timing.instrument_engine(engine)
         db.create_all()
+        # create_all skips the indexes of tables that already exist, e.g. those made by the scripts in the data folder
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(db.engine, checkfirst=True)
 
     # Include the routes from api_routes.py and main_routes.py
     from paralympic_app.api_routes import api_bp
@@ -51,5 +147,21 @@ def initialize_extensions(app):
     db.init_app(app)
     # Flask-Marshmallow
     ma.init_app(app)
-    # Dash app
+    # Password hashing pool
+    password_hasher.init_app(app)
+    # Request metrics, served at /metrics
+    metrics.init_app(app)
+    metrics.add_collector(hashing_metrics)
+    metrics.add_collector(token_cache_metrics)
+    # Server-Timing header and slow query log
+    sql_timing.init_app(app)
+    # Table versions for conditional GET requests
+    data_versions.init_app(app)
+    # Verified JWTs of the protected API routes
+    token_cache.init_app(app)
+    # Dash app, imported here as Dash and Plotly are slow to import
+    from paralympic_app.paralympic_dash_app.paralympics_dash_app import (
+        create_dash_app,
+    )
+
     create_dash_app(app)
@@ -1,4 +1,5 @@
-from datetime import datetime, timedelta
+import io
+import json
 import jwt
 from functools import wraps
 from flask import (
@@ -7,12 +8,26 @@ from flask import (
     jsonify,
     Blueprint,
     current_app as app,
+    url_for,
+    stream_with_context,
 )
 from paralympic_app.models import User
-from paralympic_app import db
+from paralympic_app import db, data_versions, token_cache
 from paralympic_app.models import Region, Event
+from sqlalchemy.exc import IntegrityError
+from app_common.password_hashing import HashingBusyError
 from paralympic_app.schemas import RegionSchema, EventSchema
-from paralympic_app.utilities import get_event, get_events
+from paralympic_app.serializers import json_response
+from paralympic_app.utilities import (
+    EVENT_FIELDS,
+    event_serializer,
+    export_rows,
+    get_event,
+    get_events,
+    insert_rows,
+    loader_options,
+    region_serializer,
+)
 
 
 # Blueprint
@@ -24,13 +39,22 @@ regions_schema = RegionSchema(many=True)
 region_schema = RegionSchema()
 events_schema = EventSchema(many=True)
 event_schema = EventSchema()
+# Schemas for the bulk routes, these load dicts of column values rather than objects
+regions_bulk_schema = RegionSchema(many=True, load_instance=False)
+events_bulk_schema = EventSchema(many=True, load_instance=False, exclude=["region"])
+
+
+# Content type of each format of the export routes
+EXPORT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
 
 
 # Custom decorator
 def token_required(f):
     """Require valid jwt for a route
 
-    Decorator to protect routes using jwt
+    Decorator to protect routes using jwt. The route is called with the user the token belongs to as its first
+    argument. Tokens that have already been verified are found in token_cache, which saves checking the signature and
+    reading the user from the database on each request.
     """
 
     @wraps(f)
@@ -41,20 +65,36 @@ def token_required(f):
             response = {"message": "Token invalid"}
             return make_response(response, 401)
         try:
-            data = jwt.decode(token, app.config["SECRET_KEY"])
-            user = db.session.execute(
-                db.select(User).filter_by(email=data.get("email"))
-            ).scalar_one_or_none()
-        except Exception as err:
+            verified = token_cache.verify(
+                token,
+                decode_token,
+                lambda user_id: db.session.get(User, user_id),
+                data_versions.version("user"),
+            )
+        except (jwt.InvalidTokenError, KeyError, ValueError):
+            verified = None
+        if verified is None:
             response = {"message": "Token invalid"}
             return make_response(response, 401)
+        _, user = verified
         return f(user, *args, **kwargs)
 
     return decorator
 
 
+def decode_token(token):
+    """Returns the claims of a token made by login, raises jwt.InvalidTokenError if it is not valid or has expired"""
+    return jwt.decode(
+        token,
+        app.config["SECRET_KEY"],
+        algorithms=["HS256"],
+        options={"require": ["exp", "sub"]},
+    )
+
+
 # API Routes
 @api_bp.get("/noc")
+@data_versions.conditional("region")
 def noc():
     """Returns a response that conatins a list of NOC region codes and their details in JSON.
 
@@ -63,7 +103,9 @@ def noc():
 
     # Query using the syntax in the Flask-SQLAlchemy 3.x documentation
     # https://flask-sqlalchemy.palletsprojects.com/en/3.0.x/queries/#select
-    all_regions = db.session.execute(db.select(Region)).scalars()
+    # The relationships that the schema dumps are loaded as set in API_RELATIONSHIP_LOADING
+    query = db.select(Region).options(*loader_options(regions_schema, Region))
+    all_regions = db.session.execute(query).scalars()
     # Get the data using Marshmallow schema
     result = regions_schema.dump(all_regions)
     response = make_response(result, 200)
@@ -71,13 +113,22 @@ def noc():
     return response
 
 
+@api_bp.get("/noc/export")
+@data_versions.conditional("region")
+def noc_export():
+    """Streams all the NOC regions as NDJSON, or as CSV with ?format=csv, see export"""
+    return export(region_serializer, region_serializer.select().order_by(Region.NOC), "noc")
+
+
 @api_bp.get("/noc/<code>")
 def noc_code(code):
     """Returns the details for a given region code."""
     # Return a 404 code if the region is not found in the database
     region = db.session.execute(
-        db.select(User).filter_by(NOC=code)
-    ).one_or_none()
+        db.select(Region)
+        .filter_by(NOC=code)
+        .options(*loader_options(region_schema, Region))
+    ).scalar_one_or_none()
     if region:
         result = region_schema.dump(region)
         response = make_response(result, 200)
@@ -102,13 +153,24 @@ def noc_add():
     notes = request.json.get("notes", "")
     region = Region(NOC=NOC, region=region, notes=notes)
     db.session.add(region)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        # e.g. the NOC already exists
+        return integrity_conflict(err)
+    data_versions.bump("region")
     result = region_schema.jsonify(region)
     response = make_response(result, 201)
     response.headers["Content-type"] = "application/json"
     return response
 
 
+@api_bp.post("/noc/bulk")
+def noc_bulk():
+    """Adds many NOC records, sent as a JSON array or as NDJSON, see bulk_add"""
+    return bulk_add(Region, regions_bulk_schema, "region")
+
+
 @api_bp.patch("/noc/<code>")
 def noc_update(code):
     """Updates changed fields for the NOC record"""
@@ -120,7 +182,12 @@ def noc_update(code):
     # Use Marshmallow to update the existing records with the changes in the json
     region_schema.load(region_json, instance=existing_region, partial=True)
     # Commit the changes to the database
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        # e.g. a new NOC that already exists, or a region with events, which would be left without one
+        return integrity_conflict(err)
+    data_versions.bump("region")
     # Return json showing the updated record
     existing_region = db.one_or_404(db.select(Region).filter_by(NOC=code))
     result = region_schema.jsonify(existing_region)
@@ -131,11 +198,16 @@ def noc_update(code):
 
 @api_bp.delete("/noc/<code>")
 @token_required
-def noc_delete(code):
+def noc_delete(current_user, code):
     """Removes a NOC record from the dataset."""
     region = db.one_or_404(db.select(Region).filter_by(NOC=code))
     db.session.delete(region)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        # The foreign_keys pragma stops a region being deleted while it has events
+        return integrity_conflict(err, "The region has events, delete or change them first")
+    data_versions.bump("region")
     # This example returns a custom HTTP response using flask make_response
     # https://flask.palletsprojects.com/en/2.2.x/api/?highlight=make_response#flask.make_response
     text = jsonify({"Successfully deleted": region.NOC})
@@ -145,21 +217,56 @@ def noc_delete(code):
 
 
 @api_bp.get("/event")
+@data_versions.conditional("event")
 def event():
-    """Returns the details for all events"""
-    result = get_events()
-    response = make_response(result, 200)
-    response.headers["Content-Type"] = "application/json"
+    """Returns the details for all events, or the events chosen by the query string arguments
+
+    type, year_from, year_to and NOC filter the events. fields is a comma separated list of the fields to return.
+    limit is the number of events on a page and after is the last event_id of the previous page, the URL of the next
+    page is in the Link header when the page is full.
+    """
+    try:
+        fields = request.args.get("fields")
+        if fields is not None:
+            fields = fields.split(",")
+            unknown = set(fields) - set(EVENT_FIELDS)
+            if unknown:
+                raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        limit = int_arg("limit")
+        if limit is not None:
+            limit = max(1, min(limit, app.config["API_MAX_PAGE_SIZE"]))
+        result = get_events(
+            event_type=request.args.get("type"),
+            year_from=int_arg("year_from"),
+            year_to=int_arg("year_to"),
+            NOC=request.args.get("NOC"),
+            fields=fields,
+            after=int_arg("after"),
+            limit=limit,
+        )
+    except ValueError as err:
+        return bad_request(str(err))
+    response = json_response(result, 200)
+    if limit is not None and len(result) == limit:
+        args = {**request.args, "after": result[-1]["event_id"], "limit": limit}
+        response.headers["Link"] = f'<{url_for("api.event", **args)}>; rel="next"'
     return response
 
 
+@api_bp.get("/event/export")
+@data_versions.conditional("event")
+def event_export():
+    """Streams all the events as NDJSON, or as CSV with ?format=csv, see export"""
+    return export(event_serializer, event_serializer.select().order_by(Event.event_id), "event")
+
+
 @api_bp.get("/event/<int:event_id>")
+@data_versions.conditional("event")
 def event_id(event_id):
     """Returns the details for a specified event"""
     result = get_event(event_id)
     if result:
-        response = make_response(result, 200)
-        response.headers["Content-Type"] = "application/json"
+        response = json_response(result, 200)
     else:
         message = jsonify(
             {
@@ -211,13 +318,24 @@ def event_add():
         highlights=highlights,
     )
     db.session.add(event)
-    db.session.commit()
+    try:
+        db.session.commit()
+    except IntegrityError as err:
+        # e.g. a NOC that is not a region, or a missing value
+        return integrity_conflict(err)
+    data_versions.bump("event")
     result = event_schema.jsonify(event)
     response = make_response(result, 201)
     response.headers["Content-Type"] = "application/json"
     return response
 
 
+@api_bp.post("/event/bulk")
+def event_bulk():
+    """Adds many event records, sent as a JSON array or as NDJSON, see bulk_add"""
+    return bulk_add(Event, events_bulk_schema, "event")
+
+
 @api_bp.patch("/event/<event_id>")
 def event_update(event_id):
     """Updates changed fields for the event
@@ -225,8 +343,10 @@ def event_update(event_id):
     """
     # Find the current event in the database
     existing_event = db.session.execute(
-        db.select(User).filter_by(event_id=event_id)
-    ).one_or_none()
+        db.select(Event)
+        .filter_by(event_id=event_id)
+        .options(*loader_options(event_schema, Event))
+    ).scalar_one_or_none()
 
     if existing_event:
         # Get the updated details from the json sent in the HTTP patch request
@@ -234,11 +354,18 @@ def event_update(event_id):
         # Use Marshmallow to update the existing records with the changes in the json
         event_schema.load(event_json, instance=existing_event, partial=True)
         # Commit the changes to the database
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError as err:
+            # e.g. a NOC that is not a region
+            return integrity_conflict(err)
+        data_versions.bump("event")
         # Return json showing the updated record
         updated_event = db.session.execute(
-            db.select(User).filter_by(event_id=event_id)
-        ).one_or_none()
+            db.select(Event)
+            .filter_by(event_id=event_id)
+            .options(*loader_options(event_schema, Event))
+        ).scalar_one_or_none()
         result = event_schema.jsonify(updated_event)
         response = make_response(result, 200)
         response.headers["Content-Type"] = "application/json"
@@ -278,6 +405,8 @@ def register():
                 "message": "Successfully registered.",
             }
             return make_response(jsonify(response)), 201
+        except HashingBusyError:
+            return server_busy()
         except Exception as err:
             response = {
                 "status": "fail",
@@ -305,22 +434,158 @@ def login():
             db.select(User).filter_by(email=email)
         ).scalar_one_or_none()
         if user and user.check_password(password):
-            payload = {
-                "exp": datetime.utcnow() + timedelta(minutes=5),
-                "iat": datetime.utcnow(),
-                "sub": user.id,
-            }
-            auth_token = jwt.encode(
-                payload, app.config.get("SECRET_KEY"), algorithm="HS256"
-            )
-            # auth_token = user.encode_auth_token(user.id)
-            if auth_token:
+            auth_token = user.encode_auth_token(user.id)
+            if isinstance(auth_token, str):
                 response = {
                     "status": "success",
                     "message": "Successfully logged in.",
+                    "token": auth_token,
                 }
                 return make_response(jsonify(response)), 200
+        response = {"status": "fail", "message": "Incorrect email or password."}
+        return make_response(jsonify(response)), 401
+    except HashingBusyError:
+        return server_busy()
     except Exception as err:
         print(err)
         response = {"status": "fail", "message": "Try again"}
         return make_response(jsonify(response)), 500
+
+
+def export(serializer, query, name):
+    """Returns a streamed response of the rows selected by the query in the format given by the format argument
+
+    The rows are read from the database and sent API_EXPORT_YIELD_PER at a time while the response is sent, so the
+    first rows arrive straight away and the memory used does not depend on the size of the table.
+    """
+    output_format = request.args.get("format", "ndjson")
+    if output_format not in EXPORT_FORMATS:
+        return bad_request(f"Unknown format: {output_format}, use one of {', '.join(EXPORT_FORMATS)}")
+    rows = export_rows(serializer, query, output_format, app.config["API_EXPORT_YIELD_PER"])
+    response = app.response_class(stream_with_context(rows), mimetype=EXPORT_FORMATS[output_format])
+    response.headers["Content-Disposition"] = f"attachment; filename={name}.{output_format}"
+    return response
+
+
+def bulk_add(model, schema, table):
+    """Validates and inserts the rows in the request body in batches of API_BULK_BATCH_SIZE rows
+
+    The body is a JSON array, or NDJSON (one JSON object per line) when the content type is application/x-ndjson,
+    which is read a line at a time. Each batch is inserted in one transaction. Rows that are not valid are left out and
+    listed in the response with their errors, rows are numbered from 0 in the order they were sent.
+
+    :return: 201 if any rows were inserted, 200 if no rows were sent, otherwise 400, with the number inserted and the
+        errors as JSON
+    """
+    if request.mimetype == "application/x-ndjson":
+        # Buffered, as reading a line from the request stream itself reads one byte at a time
+        rows = read_ndjson(io.BufferedReader(request.stream))
+    else:
+        rows = request.get_json(silent=True)
+        if not isinstance(rows, list):
+            return bad_request("Expected a JSON array, or NDJSON with the content type application/x-ndjson")
+        rows = enumerate(rows)
+
+    batch_size = app.config["API_BULK_BATCH_SIZE"]
+    inserted, errors, batch = 0, [], []
+    for number, row in rows:
+        if isinstance(row, ValueError):
+            errors.append({"row": number, "errors": {"_schema": [f"Invalid JSON: {row}"]}})
+            continue
+        batch.append((number, row))
+        if len(batch) == batch_size:
+            inserted += add_batch(model, schema, table, batch, errors)
+            batch = []
+    if batch:
+        inserted += add_batch(model, schema, table, batch, errors)
+
+    response = {
+        "status": "success" if not errors else "fail",
+        "inserted": inserted,
+        "errors": sorted(errors, key=lambda error: error["row"]),
+    }
+    if inserted:
+        status = 201
+    elif errors:
+        status = 400
+    else:
+        # An empty array or NDJSON with no rows, there is nothing to add
+        status = 200
+    return make_response(jsonify(response), status)
+
+
+def add_batch(model, schema, table, batch, errors):
+    """Inserts a batch of rows for bulk_add, adds the errors to the list and returns the number of rows inserted"""
+    inserted, batch_errors = insert_rows(model, schema, batch)
+    errors.extend(batch_errors)
+    if inserted:
+        data_versions.bump(table)
+    return inserted
+
+
+def read_ndjson(stream):
+    """Yields (row number, json) for each line of NDJSON, or (row number, ValueError) for a line that is not JSON
+
+    Blank lines are skipped and are not numbered.
+    """
+    number = 0
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield number, json.loads(line)
+        except ValueError as err:
+            yield number, err
+        number += 1
+
+
+def int_arg(name):
+    """Returns the query string argument as an int, or None if it is not in the request
+
+    :raises ValueError: if the argument is not a whole number
+    """
+    value = request.args.get(name)
+    if value is None:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a whole number") from None
+
+
+def bad_request(text):
+    """Returns a JSON response with status code 400 and the given message"""
+    message = jsonify(
+        {
+            "status": 400,
+            "error": "Bad request",
+            "message": text,
+        }
+    )
+    return make_response(message, 400)
+
+
+def integrity_conflict(err, text=None):
+    """Rolls back the session and returns a JSON response with status code 409 for a change that broke a constraint
+
+    :param err: IntegrityError raised by the commit
+    :param text: Message for the response, the database's error message if None
+    """
+    db.session.rollback()
+    message = jsonify(
+        {
+            "status": 409,
+            "error": "Conflict",
+            "message": text or f"The change conflicts with the data: {err.orig}",
+        }
+    )
+    return make_response(message, 409)
+
+
+def server_busy():
+    """Returns a 503 response for when too many passwords are waiting to be hashed"""
+    response = {
+        "status": "fail",
+        "message": "The server is busy. Please try again.",
+    }
+    return make_response(jsonify(response)), 503
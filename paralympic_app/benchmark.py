@@ -0,0 +1,338 @@
+import argparse
+import json
+import logging
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from unittest import mock
+
+
+# Database with the real events and regions, copied to make the synthetic databases
+database_file = Path(__file__).parent.joinpath("data", "paralympics.db")
+
+
+def build_database(path, events, seed=42):
+    """Writes a copy of paralympics.db to path with the number of events given, made from the real events
+
+    Each synthetic event is a real event with a random year and type, so the filters choose a known share of the rows.
+    """
+    source = sqlite3.connect(database_file)
+    target = sqlite3.connect(path)
+    source.backup(target)
+    source.close()
+    columns = [row[1] for row in target.execute("PRAGMA table_info(event)")][1:]
+    real = target.execute(f"SELECT {', '.join(columns)} FROM event").fetchall()
+    year, event_type = columns.index("year"), columns.index("type")
+    rng = random.Random(seed)
+
+    def rows():
+        for _ in range(events - len(real)):
+            row = list(rng.choice(real))
+            row[year] = rng.randint(1960, 2023)
+            row[event_type] = rng.choice(("Summer", "Winter"))
+            yield row
+
+    with target:
+        target.executemany(
+            f"INSERT INTO event ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows()
+        )
+    target.close()
+
+
+def create_benchmark_app(database, **config):
+    """Creates the paralympic app on the database, without the Dash app as it builds its charts on the first request"""
+    from paralympic_app import create_app
+    from paralympic_app.paralympic_dash_app import paralympics_dash_app
+
+    with mock.patch.object(paralympics_dash_app, "create_dash_app", lambda app: None):
+        return create_app(
+            {
+                "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}",
+                "SQLALCHEMY_ECHO": False,
+                "DATA_VERSION_FOLDER": Path(database).parent.joinpath("versions"),
+                "DASH_WARM_UP": False,
+                **config,
+            }
+        )
+
+
+def time_requests(client, url, repeat):
+    """Returns the median seconds taken by a GET request to the url and the size of the response body in bytes"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = client.get(url)
+        times.append(time.perf_counter() - start)
+    assert response.status_code == 200, response.data
+    return statistics.median(times), len(response.data)
+
+
+def benchmark_events(args):
+    """Payload size and latency of /api/event with and without filters, projection and pagination"""
+    with tempfile.TemporaryDirectory() as folder:
+        database = Path(folder, "events.db")
+        build_database(database, args.events)
+        client = create_benchmark_app(database).test_client()
+        middle = args.events // 2
+        urls = {
+            "all events": ("/api/event", 1),
+            "type=Winter&year_from=2000&year_to=2003": (
+                "/api/event?type=Winter&year_from=2000&year_to=2003",
+                args.repeat,
+            ),
+            "fields=year,type,location": ("/api/event?fields=year,type,location", 1),
+            "limit=100": ("/api/event?limit=100", args.repeat),
+            f"limit=100&after={middle}": (f"/api/event?limit=100&after={middle}", args.repeat),
+        }
+        print(f"{args.events:,} events")
+        for name, (url, repeat) in urls.items():
+            seconds, size = time_requests(client, url, repeat)
+            print(f"{name:<42} {seconds * 1000:>10,.1f} ms {size / 1e6:>10,.2f} MB")
+
+
+def benchmark_serializer(args):
+    """Events per second serialized to JSON by the Marshmallow schema and by the fast row serializer"""
+    from flask import make_response
+    from paralympic_app import db
+    from paralympic_app.models import Event
+    from paralympic_app.serializers import json_response
+    from paralympic_app.utilities import events_schema, get_events
+
+    def schema_json():
+        events = db.session.execute(db.select(Event).order_by(Event.event_id)).scalars()
+        return make_response(events_schema.dump(events)).get_data()
+
+    def fast_json():
+        return json_response(get_events()).get_data()
+
+    with tempfile.TemporaryDirectory() as folder:
+        database = Path(folder, "events.db")
+        build_database(database, args.events)
+        app = create_benchmark_app(database)
+        print(f"{args.events:,} events")
+        for name, serialize in [("Marshmallow schema dump", schema_json), ("Row serializer", fast_json)]:
+            times = []
+            for _ in range(args.repeat):
+                # A new session each time, so the ORM objects are not already in the identity map
+                with app.test_request_context():
+                    start = time.perf_counter()
+                    body = serialize()
+                    times.append(time.perf_counter() - start)
+            seconds = statistics.median(times)
+            print(f"{name:<24} {args.events / seconds:>12,.0f} events/sec {len(body) / 1e6:>8,.2f} MB")
+
+
+def benchmark_bulk(args):
+    """Events per second added by POST /api/event one event at a time and by POST /api/event/bulk"""
+    with tempfile.TemporaryDirectory() as folder:
+        database = Path(folder, "events.db")
+        build_database(database, 0)
+        client = create_benchmark_app(database).test_client()
+        # The events with every value filled in, as the schema requires
+        rows = [
+            {name: value for name, value in row.items() if name not in ("event_id", "region")}
+            for row in client.get("/api/event").json
+            if None not in (row["male"], row["female"])
+        ]
+        events = [rows[index % len(rows)] for index in range(args.rows)]
+        ndjson = "".join(json.dumps(event) + "\n" for event in events)
+
+        start = time.perf_counter()
+        for event in events[: args.single_rows]:
+            assert client.post("/api/event", json=event).status_code == 201
+        single = args.single_rows / (time.perf_counter() - start)
+
+        start = time.perf_counter()
+        response = client.post("/api/event/bulk", json=events)
+        bulk_json = args.rows / (time.perf_counter() - start)
+        assert response.json["inserted"] == args.rows, response.json["errors"][:5]
+
+        start = time.perf_counter()
+        response = client.post("/api/event/bulk", data=ndjson, content_type="application/x-ndjson")
+        bulk_ndjson = args.rows / (time.perf_counter() - start)
+        assert response.json["inserted"] == args.rows, response.json["errors"][:5]
+
+        print(f"POST /api/event, {args.single_rows} events:        {single:>10,.0f} events/sec")
+        print(f"POST /api/event/bulk, {args.rows} as JSON:    {bulk_json:>10,.0f} events/sec")
+        print(f"POST /api/event/bulk, {args.rows} as NDJSON:  {bulk_ndjson:>10,.0f} events/sec")
+
+
+def benchmark_export(args):
+    """Time to the first byte, total time and peak memory of /api/event compared with the streamed exports"""
+    with tempfile.TemporaryDirectory() as folder:
+        database = Path(folder, "events.db")
+        build_database(database, args.events)
+        client = create_benchmark_app(database).test_client()
+        print(f"{args.events:,} events")
+        for url in ["/api/event", "/api/event/export?format=ndjson", "/api/event/export?format=csv"]:
+            tracemalloc.start()
+            start = time.perf_counter()
+            response = client.get(url, buffered=False)
+            chunks = iter(response.response)
+            size = len(next(chunks))
+            first_byte = time.perf_counter() - start
+            for chunk in chunks:
+                size += len(chunk)
+            seconds = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            response.close()
+            print(
+                f"{url:<34} first byte {first_byte * 1000:>9,.1f} ms, total {seconds:>6,.1f} s, "
+                f"peak memory {peak / 1e6:>8,.1f} MB, {size / 1e6:,.1f} MB sent"
+            )
+
+
+class LockErrorCounter(logging.Handler):
+    """Counts the errors logged by Flask for requests that failed because the database was locked"""
+
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+
+    def emit(self, record):
+        if record.exc_info and "database is locked" in str(record.exc_info[1]):
+            self.count += 1
+
+
+def mixed_client(app, write, seconds, events, results):
+    """Sends requests for the given number of seconds, updates and adds events if write is True, otherwise reads the
+    events of a random year, which reads the whole event table"""
+    client = app.test_client()
+    rng = random.Random()
+    new_event = {**client.get("/api/event/1").json, "male": 0, "female": 0}
+    del new_event["event_id"], new_event["region"]
+    ok = failed = 0
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        if not write:
+            year = rng.randint(1960, 2023)
+            response = client.get(f"/api/event?year_from={year}&year_to={year}")
+        elif rng.random() < 0.5:
+            event_id = rng.randint(1, events)
+            response = client.patch(f"/api/event/{event_id}", json={"highlights": f"Updated {time.time()}"})
+        else:
+            response = client.post("/api/event", json=new_event)
+        if response.status_code < 400:
+            ok += 1
+        else:
+            failed += 1
+    results.append((write, ok, failed))
+
+
+def benchmark_mixed(args):
+    """Reads and writes per second and lock errors of concurrent clients with the default SQLite settings, with the
+    SQLITE_PRAGMAS and SQLALCHEMY_ENGINE_OPTIONS profile of the app, and with the GET requests on the read bind"""
+    profiles = {
+        "SQLite defaults (rollback journal)": {
+            "SQLITE_PRAGMAS": {},
+            "SQLALCHEMY_ENGINE_OPTIONS": {},
+            "READ_BIND_BLUEPRINTS": (),
+        },
+        "WAL and pragmas, one engine": {"READ_BIND_BLUEPRINTS": ()},
+        "WAL and pragmas, read-only GETs": {},
+    }
+    for name, config in profiles.items():
+        with tempfile.TemporaryDirectory() as folder:
+            database = Path(folder, "events.db")
+            build_database(database, args.events)
+            if config.get("SQLITE_PRAGMAS") == {}:
+                # paralympics.db, and so the copy, is in WAL mode once the app has run on it, which is saved in the file
+                with sqlite3.connect(database) as connection:
+                    connection.execute("PRAGMA journal_mode = DELETE")
+            app = create_benchmark_app(database, SQL_SLOW_QUERY_SECONDS=None, **config)
+            lock_errors = LockErrorCounter()
+            app.logger.addHandler(lock_errors)
+            app.logger.propagate = False
+            results = []
+            threads = [
+                threading.Thread(target=mixed_client, args=(app, write, args.seconds, args.events, results))
+                for write in [False] * args.readers + [True] * args.writers
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            reads = sum(ok for write, ok, _ in results if not write)
+            writes = sum(ok for write, ok, _ in results if write)
+            failed = sum(failed for _, _, failed in results)
+            print(
+                f"{name:<36} {reads / args.seconds:>8,.0f} reads/sec {writes / args.seconds:>8,.0f} writes/sec "
+                f"{failed:>6} failed requests, {lock_errors.count} database is locked"
+            )
+
+
+def benchmark_tokens(args):
+    """Latency of a protected route for a steady set of logged in users, with the token cache turned off and on"""
+    with tempfile.TemporaryDirectory() as folder:
+        for name, cache_size in [("no token cache", 0), ("token cache", 10000)]:
+            database = Path(folder, f"tokens_{cache_size}.db")
+            build_database(database, 0)
+            client = create_benchmark_app(database, API_TOKEN_CACHE_SIZE=cache_size).test_client()
+            tokens = []
+            for number in range(args.users):
+                user = {"email": f"user{number}@example.com", "password": "password"}
+                client.post("/api/register", json=user)
+                tokens.append(client.post("/api/login", json=user).json["token"])
+            times = []
+            for request_number in range(args.requests):
+                headers = {"Authorization": tokens[request_number % len(tokens)]}
+                start = time.perf_counter()
+                # A region that does not exist, so the route reads the region table and returns 404
+                response = client.delete("/api/noc/NONE", headers=headers)
+                times.append(time.perf_counter() - start)
+                assert response.status_code == 404, response.data
+            times.sort()
+            print(
+                f"{name:<16} DELETE /api/noc/<code> median {statistics.median(times) * 1e6:>6,.0f}us "
+                f"p99 {times[int(len(times) * 0.99)] * 1e6:>6,.0f}us, {args.users} users"
+            )
+
+
+def main():
+    """Benchmarks for the paralympic app, e.g. python -m paralympic_app.benchmark events"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    benchmarks = parser.add_subparsers(dest="benchmark", required=True)
+
+    events = benchmarks.add_parser("events", help=benchmark_events.__doc__)
+    events.add_argument("--events", type=int, default=1000000, help="events in the synthetic database")
+    events.add_argument("--repeat", type=int, default=20, help="requests to time for the small responses")
+    events.set_defaults(run=benchmark_events)
+
+    serializer = benchmarks.add_parser("serializer", help=benchmark_serializer.__doc__)
+    serializer.add_argument("--events", type=int, default=100000, help="events in the synthetic database")
+    serializer.add_argument("--repeat", type=int, default=5, help="times each serializer is timed")
+    serializer.set_defaults(run=benchmark_serializer)
+
+    bulk = benchmarks.add_parser("bulk", help=benchmark_bulk.__doc__)
+    bulk.add_argument("--rows", type=int, default=20000, help="events sent to the bulk route")
+    bulk.add_argument("--single-rows", type=int, default=1000, help="events sent to the single event route")
+    bulk.set_defaults(run=benchmark_bulk)
+
+    export = benchmarks.add_parser("export", help=benchmark_export.__doc__)
+    export.add_argument("--events", type=int, default=200000, help="events in the synthetic database")
+    export.set_defaults(run=benchmark_export)
+
+    mixed = benchmarks.add_parser("mixed", help=benchmark_mixed.__doc__)
+    mixed.add_argument("--events", type=int, default=100000, help="events in the synthetic database")
+    mixed.add_argument("--readers", type=int, default=8, help="threads reading the events of a year")
+    mixed.add_argument("--writers", type=int, default=4, help="threads updating and adding events")
+    mixed.add_argument("--seconds", type=float, default=10, help="length of each run")
+    mixed.set_defaults(run=benchmark_mixed)
+
+    tokens = benchmarks.add_parser("tokens", help=benchmark_tokens.__doc__)
+    tokens.add_argument("--users", type=int, default=50, help="logged in users whose tokens are sent in turn")
+    tokens.add_argument("--requests", type=int, default=5000, help="requests to time")
+    tokens.set_defaults(run=benchmark_tokens)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -43,9 +43,18 @@ create_event_table = """CREATE TABLE if not exists event(
     highlights TEXT,
     FOREIGN KEY(NOC) REFERENCES region(NOC));"""
 
+# Indexes for the filters of /api/event and for finding the events of a region, as declared on the Event model
+create_event_indexes = [
+    "CREATE INDEX if not exists ix_event_type_year ON event(type, year);",
+    "CREATE INDEX if not exists ix_event_year ON event(year);",
+    "CREATE INDEX if not exists ix_event_NOC ON event(NOC);",
+]
+
 # Create the tables in the database
 cursor.execute(create_region_table)
 cursor.execute(create_event_table)
+for create_index in create_event_indexes:
+    cursor.execute(create_index)
 
 # Commit the changes
 connection.commit()
@@ -0,0 +1,94 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from functools import wraps
+from pathlib import Path
+from flask import request, make_response
+
+
+class DataVersions:
+    """Version numbers of the database tables, used for ETag and Last-Modified headers of the API responses.
+
+    The version of a table is a time in nanoseconds saved in a small file named after the table, it is replaced by
+    the routes that change the table. The files are shared by the worker processes of a pre-fork server, and a
+    request is checked against them without opening a database connection. Changes made outside the routes, e.g. by
+    the scripts in the data folder, need a call to bump or the old version is still served.
+    """
+
+    def __init__(self, app=None):
+        self.folder = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Sets the folder of the version files from DATA_VERSION_FOLDER"""
+        self.folder = Path(app.config["DATA_VERSION_FOLDER"])
+        self.folder.mkdir(parents=True, exist_ok=True)
+        app.extensions["data_versions"] = self
+
+    def version(self, table):
+        """Returns the version of the table, the first call for a table starts it at the current time"""
+        path = self.folder.joinpath(table)
+        try:
+            return int(path.read_text())
+        except (FileNotFoundError, ValueError):
+            return self.bump(table)
+
+    def bump(self, table):
+        """Gives the table a new version, call it after committing a change to the table
+
+        Returns:
+        version (int): The new version
+        """
+        path = self.folder.joinpath(table)
+        # Never lower than the old version, e.g. if the clock has gone back
+        try:
+            version = max(time.time_ns(), int(path.read_text()) + 1)
+        except (FileNotFoundError, ValueError):
+            version = time.time_ns()
+        # Replaced in one step so other processes never read a partly written file, the temporary file is named after
+        # the process and thread so threads of the same worker do not write to the same one
+        temp_path = path.with_suffix(f".tmp{os.getpid()}-{threading.get_ident()}")
+        temp_path.write_text(str(version))
+        os.replace(temp_path, path)
+        return version
+
+    def conditional(self, *tables):
+        """Decorator for GET routes whose response only depends on the URL and the data in the tables
+
+        Successful responses are given a strong ETag made from the versions of the tables and a Last-Modified header
+        of the time of the latest change. A request with a matching If-None-Match, or If-Modified-Since when there is
+        no If-None-Match, is answered with 304 Not Modified without calling the route. If-Modified-Since only matches a
+        time at least a second after the latest change, so clients should revalidate with the ETag.
+        """
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                versions = [self.version(table) for table in tables]
+                etag = "-".join(f"{table}.{version}" for table, version in zip(tables, versions))
+                last_modified = datetime.fromtimestamp(max(versions) // 10**9, timezone.utc)
+
+                if request.if_none_match:
+                    not_modified = request.if_none_match.contains(etag)
+                else:
+                    # Last-Modified is in whole seconds, so a change in the same second as the client's copy would not
+                    # show, only a version at least a second older than If-Modified-Since is unchanged for certain
+                    since = request.if_modified_since
+                    not_modified = since is not None and max(versions) + 10**9 <= since.timestamp() * 10**9
+                if not_modified:
+                    response = make_response("", 304)
+                else:
+                    response = make_response(view(*args, **kwargs))
+                    if response.status_code != 200:
+                        return response
+                response.set_etag(etag)
+                response.last_modified = last_modified
+                # Clients may keep the response but must check it is still current before using it
+                response.cache_control.no_cache = True
+                return response
+
+            return wrapper
+
+        return decorator
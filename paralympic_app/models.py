@@ -1,9 +1,10 @@
 from datetime import datetime, timedelta
 import jwt
-import sys
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask import current_app as app
-from paralympic_app import db
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from paralympic_app import db, data_versions, password_hasher, token_cache
+from paralympic_app.read_routing import ReadRoutingSession
 
 
 class Region(db.Model):
@@ -13,7 +14,8 @@ class Region(db.Model):
     NOC = db.Column(db.Text, primary_key=True)
     region = db.Column(db.Text, nullable=False)
     notes = db.Column(db.Text)
-    events = db.relationship("Event", back_populates="region")
+    # Deleting a region leaves its events to the foreign key, rather than the ORM setting their NOC to NULL
+    events = db.relationship("Event", back_populates="region", passive_deletes="all")
 
     def __repr__(self):
         """
@@ -28,6 +30,12 @@ class Event(db.Model):
     """Paralympic event"""
 
     __tablename__ = "event"
+    # Indexes for the filters of /api/event and for finding the events of a region, created at startup if missing
+    __table_args__ = (
+        db.Index("ix_event_type_year", "type", "year"),
+        db.Index("ix_event_year", "year"),
+        db.Index("ix_event_NOC", "NOC"),
+    )
     event_id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.Text, nullable=False)
     year = db.Column(db.Integer, nullable=False)
@@ -66,8 +74,9 @@ class User(db.Model):
     password = db.Column(db.String(255), nullable=False)
 
     def __init__(self, email, password):
+        """Create a new User, the password is hashed on the password hashing pool"""
         self.email = email
-        self.password = generate_password_hash(password)
+        self.password = password_hasher.generate_password_hash(password)
 
     def __repr__(self):
         """
@@ -82,7 +91,7 @@ class User(db.Model):
 
         :return: Boolean
         """
-        return check_password_hash(self.password, password)
+        return password_hasher.check_password_hash(self.password, password)
 
     def encode_auth_token(self, user_id):
         """Generates the auth token
@@ -91,9 +100,9 @@ class User(db.Model):
         payload = {
             "exp": datetime.utcnow() + timedelta(minutes=5),
             "iat": datetime.utcnow(),
-            "sub": user_id,
+            # PyJWT only accepts a string subject
+            "sub": str(user_id),
         }
-        print(payload, file=sys.stderr)
         try:
             return jwt.encode(
                 payload, app.config.get("SECRET_KEY"), algorithm="HS256"
@@ -110,9 +119,40 @@ class User(db.Model):
         :return: integer|string
         """
         try:
-            payload = jwt.decode(auth_token, app.config.get("SECRET_KEY"))
-            return payload["sub"]
+            payload = jwt.decode(
+                auth_token,
+                app.config.get("SECRET_KEY"),
+                algorithms=["HS256"],
+                options={"require": ["exp", "sub"]},
+            )
+            return int(payload["sub"])
         except jwt.ExpiredSignatureError:
             return "Token expired. Please log in again."
         except jwt.InvalidTokenError:
             return "Invalid token. Please log in again."
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def note_changed_user(mapper, connection, user):
+    """Notes a user whose email or password is changed or who is deleted, their tokens are removed once committed"""
+    object_session(user).info.setdefault("changed_users", set()).add(user.id)
+
+
+@event.listens_for(ReadRoutingSession, "after_commit")
+def remove_cached_tokens(session):
+    """Gives the user table a new version, so every worker stops using its cached tokens, once a change is committed
+
+    This is after the commit rather than the flush, so a request cannot cache the old user again in between.
+    """
+    users = session.info.pop("changed_users", None)
+    if users:
+        data_versions.bump("user")
+        for user_id in users:
+            token_cache.invalidate_user(user_id)
+
+
+@event.listens_for(ReadRoutingSession, "after_rollback")
+def forget_changed_users(session):
+    """Forgets the changed users of a transaction that was rolled back"""
+    session.info.pop("changed_users", None)
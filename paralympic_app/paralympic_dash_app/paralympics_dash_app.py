@@ -1,38 +1,50 @@
+from functools import cache
+import threading
 from dash import html, dcc, Dash, dash_table, Input, Output
 import dash_bootstrap_components as dbc
-from paralympic_app.paralympic_dash_app import create_charts as cc
+from paralympic_app import metrics
 
 
-fig_line_sports = cc.line_chart_sports()
-fig_sb_gender_winter = cc.stacked_bar_gender("Winter")
-fig_sb_gender_summer = cc.stacked_bar_gender("Summer")
-fig_scatter_mapbox = cc.scatter_mapbox_para_locations("OSM")
-df_medals_data = cc.top_ten_gold_data()
-df_medals = cc.get_medals_table_data("London", 2012)
-fig_cp_map_medals = cc.choropleth_mapbox_medals(df_medals)
+@cache
+def create_layout():
+    """
+    Creates the charts and the layout of the dashboard. This reads the data files and builds all the figures so it is
+    only done once, either by the warm up thread or when the dashboard is first requested.
 
+    :return: dbc.Container The layout of the dashboard
+    """
+    # Imported here as Plotly Express and pandas are slow to import
+    from paralympic_app.paralympic_dash_app import create_charts as cc
 
-def create_dash_app(flask_app):
-    """Creates Dash as a route in Flask
+    df_medals_data = cc.top_ten_gold_data()
+    df_medals = cc.get_medals_table_data("London", 2012)
+    return build_layout(
+        fig_line_sports=cc.line_chart_sports(),
+        fig_sb_gender_winter=cc.stacked_bar_gender("Winter"),
+        fig_sb_gender_summer=cc.stacked_bar_gender("Summer"),
+        fig_scatter_mapbox=cc.scatter_mapbox_para_locations("OSM"),
+        medals_columns=[{"name": i, "id": i} for i in df_medals_data.columns],
+        medals_data=df_medals_data.to_dict("records"),
+        fig_cp_map_medals=cc.choropleth_mapbox_medals(df_medals),
+    )
 
-    :param flask_app: A confired Flask app
-    :return dash_app: A configured Dash app registered to the Flask app
+
+def build_layout(
+    fig_line_sports=None,
+    fig_sb_gender_winter=None,
+    fig_sb_gender_summer=None,
+    fig_scatter_mapbox=None,
+    medals_columns=None,
+    medals_data=None,
+    fig_cp_map_medals=None,
+):
     """
-    # Register the Dash app to a route '/dashboard/' on a Flask app
-    dash_app = Dash(
-        __name__,
-        server=flask_app,
-        url_base_pathname="/dashboard/",
-        meta_tags=[
-            {
-                "name": "viewport",
-                "content": "width=device-width, initial-scale=1",
-            }
-        ],
-        external_stylesheets=[dbc.themes.BOOTSTRAP],
-    )
+    Arranges the charts in the dashboard layout. Called without any charts it returns the same components with empty
+    figures, which Dash uses to check the callbacks without building the charts.
 
-    dash_app.layout = dbc.Container(
+    :return: dbc.Container The layout of the dashboard
+    """
+    return dbc.Container(
         [
             html.H1("Paralympic History"),
             html.H2(
@@ -51,7 +63,7 @@ def create_dash_app(flask_app):
                 ),
                 style={"width": "150px"},
             ),
-            dcc.Graph(id="line-sports", figure=fig_line_sports),
+            dcc.Graph(id="line-sports", figure=fig_line_sports or {}),
             html.H2(
                 "Has the ratio of male and female athletes changed over time?"
             ),
@@ -65,33 +77,67 @@ def create_dash_app(flask_app):
                 labelStyle={"display": "block"},
             ),
             dcc.Graph(
-                id="stacked-bar-gender-win", figure=fig_sb_gender_winter
+                id="stacked-bar-gender-win", figure=fig_sb_gender_winter or {}
             ),
             dcc.Graph(
-                id="stacked-bar-gender-sum", figure=fig_sb_gender_summer
+                id="stacked-bar-gender-sum", figure=fig_sb_gender_summer or {}
             ),
             html.H2("Where in the world have the Paralympics have been held?"),
-            dcc.Graph(id="scatter-mapbox-osm", figure=fig_scatter_mapbox),
+            dcc.Graph(id="scatter-mapbox-osm", figure=fig_scatter_mapbox or {}),
             html.H2(
                 "Which countries have won the most gold medals since 1960?"
             ),
             dash_table.DataTable(
                 id="table-top-ten-gold-dash",
-                columns=[{"name": i, "id": i} for i in df_medals_data.columns],
-                data=df_medals_data.to_dict("records"),
+                columns=medals_columns or [],
+                data=medals_data or [],
                 style_cell=dict(textAlign="left"),
             ),
             html.H2("What is the medal performance of each country?"),
             html.P("Medal performance in London 2012"),
-            dcc.Graph(id="cp-map-medals", figure=fig_cp_map_medals),
+            dcc.Graph(id="cp-map-medals", figure=fig_cp_map_medals or {}),
         ],
         fluid=True,
     )
 
+
+def create_dash_app(flask_app):
+    """Creates Dash as a route in Flask
+
+    The charts are not created until the layout is first needed, if DASH_WARM_UP is set in the Flask config they are
+    created by a background thread.
+
+    :param flask_app: A confired Flask app
+    :return dash_app: A configured Dash app registered to the Flask app
+    """
+    # Register the Dash app to a route '/dashboard/' on a Flask app
+    dash_app = Dash(
+        __name__,
+        server=flask_app,
+        url_base_pathname="/dashboard/",
+        meta_tags=[
+            {
+                "name": "viewport",
+                "content": "width=device-width, initial-scale=1",
+            }
+        ],
+        external_stylesheets=[dbc.themes.BOOTSTRAP],
+    )
+
+    # The callbacks are checked against the layout without its charts, otherwise Dash would build the charts now
+    dash_app.validation_layout = build_layout()
+    # Dash calls the function for each page load, create_layout is cached so the charts are only created once
+    dash_app.layout = metrics.timed("dash_layout_seconds")(create_layout)
+    if flask_app.config.get("DASH_WARM_UP"):
+        threading.Thread(
+            target=create_layout, name="dash-warm-up", daemon=True
+        ).start()
+
     @dash_app.callback(
         Output(component_id="line-sports", component_property="figure"),
         Input(component_id="type-dropdown", component_property="value"),
     )
+    @metrics.timed("dash_callback_seconds", callback="update_output_div")
     def update_output_div(event_variable):
         """
         Call back for updating the line chart when the type of data to display is changed.
@@ -100,6 +146,8 @@ def create_dash_app(flask_app):
         'COUNTRIES', 'PARTICIPANTS']
         :return: plotly.px.Figure The line chart representing the chosen variable
         """
+        from paralympic_app.paralympic_dash_app import create_charts as cc
+
         fig_line_time = cc.line_chart_over_time(event_variable)
         return fig_line_time
 
@@ -110,6 +158,7 @@ def create_dash_app(flask_app):
         ],
         Input("mf-ratio-checklist", "value"),
     )
+    @metrics.timed("dash_callback_seconds", callback="show_hide_ratio_charts")
     def show_hide_ratio_charts(selected_types):
         """
         Callback to display or hide the winter and summer male:female ratio bar charts depending on the checkbox values.
@@ -0,0 +1,63 @@
+from urllib.parse import quote
+from flask import current_app, has_request_context, request
+from flask_sqlalchemy.session import Session
+from sqlalchemy.engine import make_url
+
+# Bind key of the engine that the GET requests read from
+READ_BIND = "read"
+
+
+class ReadRoutingSession(Session):
+    """Session that runs the SELECTs of GET requests on the read bind, and everything else on the main database.
+
+    A SELECT goes to the read bind when the request is a GET or HEAD to a blueprint in READ_BIND_BLUEPRINTS and the
+    app has a read bind. Writes, including the flush of objects changed during a GET request, still go to the main
+    database, so a GET route that does write works as before.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, "is_select", False) and is_read_request():
+            engine = self._db.engines.get(READ_BIND)
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def is_read_request():
+    """Returns True in a GET or HEAD request to one of the READ_BIND_BLUEPRINTS"""
+    return (
+        has_request_context()
+        and request.method in ("GET", "HEAD")
+        and request.blueprint in current_app.config["READ_BIND_BLUEPRINTS"]
+    )
+
+
+def add_read_bind(app):
+    """Adds the read bind to SQLALCHEMY_BINDS, call it before Flask-SQLAlchemy is initialised
+
+    The bind is READ_BIND_URI, e.g. a replica of the database, or when that is None the main database if it is an
+    SQLite file, opened read-only. There is no read bind for other databases unless READ_BIND_URI is set.
+    """
+    uri = app.config["READ_BIND_URI"] or read_only_uri(app.config["SQLALCHEMY_DATABASE_URI"])
+    if uri is not None:
+        app.config["SQLALCHEMY_BINDS"] = {**app.config.get("SQLALCHEMY_BINDS", {}), READ_BIND: uri}
+
+
+def read_only_uri(uri):
+    """Returns the URI that opens an SQLite database file read-only, or None if uri is not an SQLite file
+
+    :param uri: SQLAlchemy database URI, e.g. sqlite:///data/paralympics.db
+    :return: URI of the file with mode=ro, e.g. sqlite:///file:data/paralympics.db?mode=ro&uri=true
+    """
+    url = make_url(uri)
+    if url.get_backend_name() != "sqlite" or url.database in (None, "", ":memory:") or url.query.get("uri"):
+        return None
+    return f"sqlite:///file:{quote(url.database)}?mode=ro&uri=true"
+
+
+def read_pragmas(pragmas):
+    """Returns the SQLITE_PRAGMAS for the read bind, which refuses writes with query_only
+
+    journal_mode is left out as a read-only connection cannot change it, the main database sets it.
+    """
+    return {**{name: value for name, value in pragmas.items() if name != "journal_mode"}, "query_only": "ON"}
@@ -0,0 +1,160 @@
+import json
+import re
+from functools import lru_cache
+from flask import current_app as app, make_response
+from flask.json.provider import DefaultJSONProvider
+from marshmallow import fields
+from marshmallow_sqlalchemy.fields import Related
+from sqlalchemy import inspect, select
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Runs of bytes that Python's json module escapes when ensure_ascii is set, i.e. DEL and UTF-8 encoded characters
+NOT_ASCII = re.compile(rb"[\x7f-\xff]+")
+# Characters outside the Basic Multilingual Plane as escaped by the backslashreplace error handler
+ASTRAL_ESCAPE = re.compile(rb"\\U([0-9a-f]{8})")
+
+
+class RowSerializer:
+    """Turns Core rows into the same dicts as the dump of a Marshmallow schema, without creating ORM objects.
+
+    The column and the conversion of each field are worked out once from the schema, in the order the schema dumps
+    them. Integer fields are converted with int and String fields with str as Marshmallow does. A Related field, such
+    as the region of an event, is the primary key of the related row, which is selected with an outer join. A schema
+    with any other type of field raises TypeError so a change to the schema cannot go unnoticed.
+    """
+
+    def __init__(self, schema, model):
+        self.model = model
+        self.columns = {}
+        self.converters = {}
+        self.joins = {}
+        self._row_functions = {}
+        for name, field in schema.dump_fields.items():
+            attribute = getattr(model, field.attribute or name)
+            if isinstance(field, Related):
+                relationship = inspect(model).relationships[field.attribute or name]
+                target = relationship.mapper
+                if relationship.uselist or len(target.primary_key) != 1:
+                    raise TypeError(f"{name} must be a many-to-one relationship to a single column primary key")
+                self.columns[name] = target.primary_key[0].label(name)
+                self.joins[name] = attribute
+                self.converters[name] = None
+            elif isinstance(field, fields.Integer):
+                self.columns[name] = attribute.label(name)
+                self.converters[name] = int
+            elif isinstance(field, fields.String):
+                self.columns[name] = attribute.label(name)
+                self.converters[name] = str
+            else:
+                raise TypeError(f"No fast conversion for the {type(field).__name__} field {name}")
+
+    def select(self, names=None):
+        """Returns a select of the columns of the fields, all of them if names is None
+
+        :param names: Field names in the order the schema dumps them
+        """
+        names = list(self.columns) if names is None else names
+        query = select(*(self.columns[name] for name in names)).select_from(self.model)
+        for name in names:
+            if name in self.joins:
+                query = query.outerjoin(self.joins[name])
+        return query
+
+    def dump(self, rows):
+        """Returns a list of dicts of the rows, which were selected with select()
+
+        :param rows: Result of executing the select
+        """
+        return list(map(self.row_function(tuple(rows.keys())), rows))
+
+    def row_function(self, names):
+        """Returns a function that turns a row with the fields in names into a dict
+
+        The function is compiled from a dict display with one entry per field, so a row is converted without a
+        Python function call for each value. A value is only converted when it is not of the field's type already.
+        """
+        function = self._row_functions.get(names)
+        if function is None:
+            entries = []
+            for index, name in enumerate(names):
+                convert = self.converters[name]
+                if convert is None:
+                    entries.append(f"{name!r}: row[{index}]")
+                else:
+                    entries.append(
+                        f"{name!r}: value if (value := row[{index}]) is None or value.__class__ is {convert.__name__} "
+                        f"else {convert.__name__}(value)"
+                    )
+            source = "lambda row: {" + ", ".join(entries) + "}"
+            function = self._row_functions[names] = eval(source, {"int": int, "str": str})
+        return function
+
+
+def json_response(data, status=200):
+    """Returns data as a JSON response with the same bytes as Flask's make_response, encoded with orjson if installed
+
+    Flask's JSON provider sorts the keys, escapes characters that are not ASCII and leaves out spaces unless the app is
+    in debug mode. orjson sorts the keys the same way but writes other characters as UTF-8, so these are escaped
+    afterwards, which is quick as they are rare. Flask encodes the data when it would indent the JSON. The two format
+    floats differently, so data must not contain floats, as is the case for the dicts of a RowSerializer.
+    """
+    provider = app.json
+    compact = provider.compact is True or (provider.compact is None and not app.debug)
+    default_format = provider.sort_keys and provider.ensure_ascii and compact
+    if orjson is not None and type(provider) is DefaultJSONProvider and default_format:
+        try:
+            body = orjson.dumps(data, option=orjson.OPT_SORT_KEYS)
+        except TypeError:
+            # e.g. a value orjson cannot encode
+            body = None
+        if body is not None:
+            response = app.response_class(ascii_json(body) + b"\n", mimetype=provider.mimetype)
+            response.status_code = status
+            return response
+    return make_response(data, status)
+
+
+def json_lines(rows):
+    """Returns NDJSON of the dicts, each line is encoded the same way as json_response encodes a dict
+
+    :param rows: List of dicts from a RowSerializer
+    :return: bytes with one JSON object per line
+    """
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_APPEND_NEWLINE
+        return ascii_json(b"".join([orjson.dumps(row, option=option) for row in rows]))
+    lines = [json.dumps(row, sort_keys=True, separators=(",", ":")) + "\n" for row in rows]
+    return "".join(lines).encode()
+
+
+def ascii_json(body):
+    """Escapes the characters of JSON encoded by orjson that Python's json module escapes when ensure_ascii is set
+
+    Python's backslashreplace error handler escapes every character that is not ASCII in one pass, then its \\xNN
+    escapes are written as \\u00NN and its \\UNNNNNNNN escapes as a surrogate pair, as Python's json module does.
+    JSON has no escapes that start with \\x or \\U, so this is only done when the data has no backslashes, which
+    orjson writes as \\\\. Otherwise each run of characters is escaped with a regular expression, which is slower.
+    """
+    if body.isascii() and b"\x7f" not in body:
+        return body
+    if b"\\\\" in body:
+        return NOT_ASCII.sub(escape, body)
+    body = body.decode().encode("ascii", "backslashreplace")
+    body = body.replace(b"\\x", b"\\u00").replace(b"\x7f", b"\\u007f")
+    if b"\\U" in body:
+        body = ASTRAL_ESCAPE.sub(lambda match: escape_text(chr(int(match.group(1), 16)).encode()), body)
+    return body
+
+
+def escape(match):
+    """Returns the characters of a NOT_ASCII match escaped as Python's json module does, e.g. \\u00fc for ü"""
+    return escape_text(match.group())
+
+
+@lru_cache(maxsize=1024)
+def escape_text(text):
+    return json.dumps(text.decode())[1:-1].encode()
@@ -0,0 +1,76 @@
+import hashlib
+import time
+from app_common.cache import LRUCache
+
+
+class TokenUser:
+    """Copy of the User a token belongs to, it holds no database session and no password hash"""
+
+    def __init__(self, id, email):
+        self.id = id
+        self.email = email
+
+    def __repr__(self):
+        clsname = self.__class__.__name__
+        return f"{clsname}: <{self.id}, {self.email}>"
+
+
+class TokenCache(LRUCache):
+    """Cache of verified JWTs, so a protected route does not check the signature or query the user on every request.
+
+    Entries are keyed on the SHA-256 digest of the token, so the tokens themselves are not kept, and hold the claims
+    and the user until the token expires or the cache's time to live has passed, whichever is sooner. Each entry also
+    holds the version of the user table it was made at, and is only used while the table has that version. A commit
+    that changes or deletes a user gives the table a new version through data_versions, whose files are shared by the
+    worker processes, so every worker stops using its entries. Workers that do not share DATA_VERSION_FOLDER, e.g. on
+    other hosts, are not told and keep using a changed user's tokens for up to API_TOKEN_CACHE_TTL.
+    """
+
+    def __init__(self, app=None):
+        super().__init__(maxsize=10000, ttl=60.0)
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Configures the cache from the app config
+
+        API_TOKEN_CACHE_SIZE is the maximum number of tokens (0 turns the cache off) and API_TOKEN_CACHE_TTL is the
+        most seconds a token is kept. The cache is emptied, as the app may use a different database.
+        """
+        self.clear()
+        self.maxsize = app.config.get("API_TOKEN_CACHE_SIZE", 10000)
+        self.ttl = app.config.get("API_TOKEN_CACHE_TTL", 60.0)
+        app.extensions["token_cache"] = self
+
+    def verify(self, token, decode, query, version):
+        """Returns the claims and user of the token from the cache, or decodes the token and queries the user
+
+        :param token: JWT from the Authorization header
+        :param decode: Returns the claims of a token, raises jwt.InvalidTokenError if it is not valid or has expired
+        :param query: Returns the User with the id in the sub claim from the database, or None
+        :param version: Current version of the user table, read before the user is queried so a change committed
+            while the user is read gives a new version and the entry is not used
+        :return: (claims, TokenUser), or None if the user does not exist
+        """
+        key = hashlib.sha256(token.encode()).digest()
+        if self.enabled:
+            entry = self.get(key)
+            if entry is not None and entry[2] == version:
+                return entry[:2]
+        claims = decode(token)
+        user = query(int(claims["sub"]))
+        if user is None:
+            return None
+        user = TokenUser(user.id, user.email)
+        # exp is seconds since the epoch, the entry is kept for at most the rest of the token's life
+        ttl = min(self.ttl, claims["exp"] - time.time())
+        if self.enabled and ttl > 0:
+            self.put(key, (claims, user, version), ttl)
+        return claims, user
+
+    def invalidate_user(self, user_id):
+        """Removes the entries of every token of the user"""
+        with self._lock:
+            keys = [key for key, ((_, user, _), _) in self._entries.items() if user.id == user_id]
+            for key in keys:
+                del self._entries[key]
@@ -1,33 +1,188 @@
+import csv
+import io
 import sys
-from paralympic_app import db
-from paralympic_app.models import Event
-from paralympic_app.schemas import EventSchema
+from flask import current_app as app
+from marshmallow import ValidationError
+from marshmallow_sqlalchemy.fields import Nested, Related
+from sqlalchemy import inspect
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import joinedload, lazyload, raiseload, selectinload
+from paralympic_app import db, metrics
+from paralympic_app.models import Event, Region
+from paralympic_app.schemas import EventSchema, RegionSchema
+from paralympic_app.serializers import RowSerializer, json_lines
 
 
 # Marshmallow Schemas
 events_schema = EventSchema(many=True)
 event_schema = EventSchema()
 
+# Selects events and regions as rows and converts them to the same dicts as the schemas' dump
+event_serializer = RowSerializer(event_schema, Event)
+region_serializer = RowSerializer(RegionSchema(), Region)
 
-def get_events():
-    """Function to get all events from the database as objects and convert to json.
+# Loader options for the strategies named in API_RELATIONSHIP_LOADING
+LOADERS = {
+    "selectin": selectinload,
+    "joined": joinedload,
+    "lazy": lazyload,
+    "raise": raiseload,
+}
+
+# Names of the fields of an event in the JSON, e.g. for the fields argument of /api/event
+EVENT_FIELDS = tuple(event_serializer.columns)
+
+
+def loader_options(schema, model):
+    """Returns the loader options for the relationships of the model that the schema dumps
+
+    The strategy of each relationship is set in API_RELATIONSHIP_LOADING, e.g. {"Event.region": "joined"}, a
+    relationship that is not in the config is loaded lazily, i.e. with a SELECT for each object when it is first used.
+    Use the options on a select of the model, so dumping a list of objects takes a fixed number of queries.
+
+    :param schema: Marshmallow schema that will dump the objects
+    :param model: Model class that is selected
+    :return: List of loader options
+    """
+    strategies = app.config["API_RELATIONSHIP_LOADING"]
+    relationships = inspect(model).relationships
+    options = []
+    for name, field in schema.dump_fields.items():
+        key = field.attribute or name
+        if isinstance(field, (Related, Nested)) and key in relationships:
+            attribute = getattr(model, key)
+            options.append(LOADERS[strategies.get(str(attribute), "lazy")](attribute))
+    return options
+
+
+@metrics.timed("paralympic_get_events_seconds")
+def get_events(
+    event_type=None,
+    year_from=None,
+    year_to=None,
+    NOC=None,
+    fields=None,
+    after=None,
+    limit=None,
+):
+    """Function to get events from the database and convert to json.
+
+    The filters, the projection and the page are all part of the SELECT, so only the rows and columns asked for are
+    read from the database. The rows are converted by event_serializer rather than loaded as Event objects and dumped
+    by the schema, which gives the same json.
 
     NB: This was extracted to a separate function as it is used in multiple places
+
+    :param event_type: Only events of this type, e.g. Summer
+    :param year_from: Only events in or after this year
+    :param year_to: Only events in or before this year
+    :param NOC: Only events hosted by this NOC region code
+    :param fields: Names from EVENT_FIELDS to return, event_id is always returned. None for all the fields.
+    :param after: Only events with an event_id greater than this, i.e. the last event_id of the previous page
+    :param limit: Maximum number of events to return
+    :return: List of event json in event_id order
     """
-    all_events = db.session.execute(db.select(Event)).scalars()
-    event_json = events_schema.dump(all_events)
-    return event_json
+    if fields is not None:
+        # event_id identifies the event and is the cursor for the next page
+        fields = [name for name in EVENT_FIELDS if name in fields or name == "event_id"]
+    query = event_serializer.select(fields).order_by(Event.event_id)
+    if event_type is not None:
+        query = query.where(Event.type == event_type)
+    if year_from is not None:
+        query = query.where(Event.year >= year_from)
+    if year_to is not None:
+        query = query.where(Event.year <= year_to)
+    if NOC is not None:
+        query = query.where(Event.NOC == NOC)
+    if after is not None:
+        query = query.where(Event.event_id > after)
+    if limit is not None:
+        query = query.limit(limit)
+
+    return event_serializer.dump(db.session.execute(query))
 
 
 def get_event(event_id):
     """Function to get a single event as a json structure
 
     :return Event json or None: Event JSON if event exists, otherwise None"""
-    event = db.session.execute(
-        db.select(Event).filter_by(event_id=event_id)
-    ).scalar_one_or_none()
-    if event:
-        result = events_schema.dump(event)
-        return result
+    query = event_serializer.select().where(Event.event_id == event_id)
+    events = event_serializer.dump(db.session.execute(query))
+    if events:
+        return events[0]
+    else:
+        return None
+
+
+def insert_rows(model, schema, rows):
+    """Validates a batch of rows and inserts the valid ones with one executemany in a single transaction
+
+    If a row breaks a constraint of the table, e.g. a NOC that already exists, the batch is rolled back and the rows
+    are inserted one at a time in a new transaction, as SQLite only undoes the statement that failed.
+
+    :param model: Model class of the table, e.g. Event
+    :param schema: Schema with many=True and load_instance=False that turns the rows into dicts of column values
+    :param rows: List of (row number, json) of the rows in the batch
+    :return: (number of rows inserted, list of {"row": row number, "errors": messages} for the rows not inserted)
+    """
+    numbers = [number for number, _ in rows]
+    errors = []
+    try:
+        values = schema.load([row for _, row in rows])
+        valid = list(zip(numbers, values))
+    except ValidationError as err:
+        errors = [{"row": numbers[index], "errors": messages} for index, messages in err.messages.items()]
+        valid = [
+            (number, value)
+            for index, (number, value) in enumerate(zip(numbers, err.valid_data))
+            if index not in err.messages
+        ]
+    if not valid:
+        return 0, errors
+
+    connection = db.session.connection()
+    try:
+        connection.execute(db.insert(model), [value for _, value in valid])
+        inserted = len(valid)
+    except IntegrityError:
+        # The rows before the failed one have been inserted, so start the transaction again
+        db.session.rollback()
+        connection = db.session.connection()
+        inserted = 0
+        for number, value in valid:
+            try:
+                connection.execute(db.insert(model), [value])
+                inserted += 1
+            except IntegrityError as err:
+                errors.append({"row": number, "errors": {"_schema": [str(err.orig)]}})
+    db.session.commit()
+    return inserted, errors
+
+
+def export_rows(serializer, query, output_format, yield_per):
+    """Yields the rows selected by the query as NDJSON or CSV, a chunk of up to yield_per rows at a time
+
+    The query is run when the first chunk is needed and the rows are fetched from the database yield_per at a time, so
+    the memory used does not grow with the number of rows. Call it inside stream_with_context so the query runs in
+    the request's session. The values are converted as for the JSON, e.g. a year stored as text is written as a number.
+
+    :param serializer: RowSerializer of the table
+    :param query: Select from serializer.select()
+    :param output_format: "ndjson" or "csv", the CSV starts with a header row of the field names
+    :param yield_per: Number of rows fetched and sent at a time
+    """
+    rows = db.session.execute(query.execution_options(yield_per=yield_per))
+    names = tuple(rows.keys())
+    to_dict = serializer.row_function(names)
+    if output_format == "csv":
+        text = io.StringIO()
+        writer = csv.writer(text)
+        writer.writerow(names)
+        for partition in rows.partitions():
+            writer.writerows(row.values() for row in map(to_dict, partition))
+            yield text.getvalue()
+            text.seek(0)
+            text.truncate()
     else:
-        return event
+        for partition in rows.partitions():
+            yield json_lines(map(to_dict, partition))
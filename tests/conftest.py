@@ -0,0 +1,56 @@
+import shutil
+from pathlib import Path
+import pytest
+
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+
+@pytest.fixture()
+def paralympic_app(tmp_path, monkeypatch):
+    """Paralympic app using a copy of paralympics.db, so the tests can change the data
+
+    The Dash app is left out, Dash builds the charts on the first request to any route and these tests only use the
+    API and the pages.
+    """
+    from paralympic_app import create_app
+    from paralympic_app.paralympic_dash_app import paralympics_dash_app
+
+    monkeypatch.setattr(paralympics_dash_app, "create_dash_app", lambda app: None)
+
+    database = tmp_path.joinpath("paralympics.db")
+    shutil.copy(PROJECT_ROOT.joinpath("paralympic_app", "data", "paralympics.db"), database)
+    return create_app(
+        {
+            "TESTING": True,
+            "SQLALCHEMY_DATABASE_URI": f"sqlite:///{database}",
+            "SQLALCHEMY_ECHO": False,
+            "DATA_VERSION_FOLDER": tmp_path.joinpath("versions"),
+            "DASH_WARM_UP": False,
+        }
+    )
+
+
+@pytest.fixture()
+def paralympic_client(paralympic_app):
+    return paralympic_app.test_client()
+
+
+@pytest.fixture()
+def sql_statements(paralympic_app):
+    """List of the SQL statements run on the paralympic app's databases, the main one and the read bind, during the test"""
+    from sqlalchemy import event
+    from paralympic_app import db
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with paralympic_app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        event.listen(engine, "before_cursor_execute", record)
+    yield statements
+    for engine in engines:
+        event.remove(engine, "before_cursor_execute", record)
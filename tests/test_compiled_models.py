@@ -0,0 +1,55 @@
+import pickle
+from pathlib import Path
+import pandas as pd
+import pytest
+from sklearn.model_selection import ParameterGrid
+from iris_app.compiled_models import compile_model, load_artifact, predictions_match, save_artifact
+from iris_app.data.create_ml_model import CANDIDATES, prepare_data
+
+
+DATA_FOLDER = Path(__file__).parent.parent.joinpath("iris_app", "data")
+
+
+@pytest.fixture(scope="module")
+def iris_data():
+    """Feature values and labels of every row of iris.csv"""
+    return prepare_data(pd.read_csv(DATA_FOLDER.joinpath("iris.csv")))
+
+
+def candidate_models():
+    """Every algorithm and set of hyperparameters that create_ml_model.py tries"""
+    return [
+        pytest.param(alg, params, id=f"{name}-{index}")
+        for name, (alg, grid) in CANDIDATES.items()
+        for index, params in enumerate(ParameterGrid(grid))
+    ]
+
+
+@pytest.mark.parametrize("alg, params", candidate_models())
+def test_compiled_model_matches_sklearn(iris_data, alg, params):
+    """The compiled model predicts exactly the same labels as scikit-learn for every row of iris.csv"""
+    X, y = iris_data
+    model = alg(**params).fit(X, y)
+    assert predictions_match(compile_model(model), model, X)
+
+
+@pytest.mark.parametrize("name", ["lr", "dt"])
+def test_saved_model_compiles_exactly(iris_data, name):
+    """The models saved in the data folder give the same predictions when compiled"""
+    X, _ = iris_data
+    try:
+        with open(DATA_FOLDER.joinpath(f"model_{name}.pkl"), "rb") as pickle_file:
+            model = pickle.load(pickle_file)
+    except Exception as err:
+        pytest.skip(f"model_{name}.pkl cannot be loaded with this version of scikit-learn: {err}")
+    assert predictions_match(compile_model(model), model, X)
+
+
+@pytest.mark.parametrize("name", ["lr", "dt"])
+def test_artifact_round_trip(iris_data, tmp_path, name):
+    """A compiled model saved as an artifact and memory-mapped again gives the same predictions"""
+    X, y = iris_data
+    alg, grid = CANDIDATES[name]
+    model = alg(**ParameterGrid(grid)[0]).fit(X, y)
+    save_artifact(compile_model(model), tmp_path)
+    assert predictions_match(load_artifact(tmp_path), model, X)
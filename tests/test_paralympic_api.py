@@ -0,0 +1,324 @@
+import csv
+import io
+import json
+import logging
+import shutil
+import sqlite3
+import pytest
+from sqlalchemy import event
+from sqlalchemy.exc import OperationalError
+
+
+def test_event_list_not_modified(paralympic_client, sql_statements):
+    """A request with the ETag of the current data gets 304 without running a query"""
+    first = paralympic_client.get("/api/event")
+    assert first.status_code == 200
+    assert first.headers["ETag"].startswith('"event.')
+    assert first.headers["Last-Modified"]
+
+    sql_statements.clear()
+    second = paralympic_client.get("/api/event", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 304
+    assert second.data == b""
+    assert second.headers["ETag"] == first.headers["ETag"]
+    assert sql_statements == []
+
+
+def test_event_change_gives_new_etag(paralympic_client):
+    """Changing an event gives the event list a new ETag, the region list keeps its ETag"""
+    events = paralympic_client.get("/api/event")
+    regions = paralympic_client.get("/api/noc")
+    update = paralympic_client.patch("/api/event/1", json={"highlights": "Updated"})
+    assert update.status_code == 200
+
+    events_after = paralympic_client.get("/api/event", headers={"If-None-Match": events.headers["ETag"]})
+    assert events_after.status_code == 200
+    assert events_after.headers["ETag"] != events.headers["ETag"]
+    regions_after = paralympic_client.get("/api/noc", headers={"If-None-Match": regions.headers["ETag"]})
+    assert regions_after.status_code == 304
+
+
+def test_if_modified_since_sees_change_in_same_second(paralympic_client):
+    """A change made in the same second as the client's copy is not answered with 304 Not Modified"""
+    first = paralympic_client.get("/api/event/1")
+    assert paralympic_client.patch("/api/event/1", json={"highlights": "Updated"}).status_code == 200
+    second = paralympic_client.get("/api/event/1", headers={"If-Modified-Since": first.headers["Last-Modified"]})
+    assert second.status_code == 200
+    assert second.json["highlights"] == "Updated"
+
+    later = "Fri, 01 Jan 2100 00:00:00 GMT"
+    assert paralympic_client.get("/api/event/1", headers={"If-Modified-Since": later}).status_code == 304
+
+
+def test_event_filters_and_fields(paralympic_client):
+    """Only the events and fields asked for are returned"""
+    response = paralympic_client.get("/api/event?type=Winter&year_from=1990&year_to=2000&fields=year,NOC")
+    assert response.status_code == 200
+    assert response.json == [
+        {"event_id": 20, "year": 1992, "NOC": "FRA"},
+        {"event_id": 21, "year": 1994, "NOC": "NOR"},
+        {"event_id": 22, "year": 1998, "NOC": "JPN"},
+    ]
+    assert paralympic_client.get("/api/event?fields=bad").status_code == 400
+    assert paralympic_client.get("/api/event?year_from=1990s").status_code == 400
+
+
+def test_event_pages(paralympic_client):
+    """Following the Link headers gives every event once, in event_id order"""
+    events = paralympic_client.get("/api/event").json
+    pages = []
+    url = "/api/event?limit=10"
+    while url:
+        response = paralympic_client.get(url)
+        pages.append(response.json)
+        link = response.headers.get("Link")
+        url = link[1 : link.index(">")] if link else None
+    assert [len(page) for page in pages] == [10, 10, 7]
+    assert [event for page in pages for event in page] == events
+
+
+NEW_EVENT = {
+    "type": "Summer",
+    "year": 2032,
+    "location": "Brisbane",
+    "NOC": "AUS",
+    "start": "24-Aug-32",
+    "end": "5-Sep-32",
+    "disabilities_included": "All",
+    "events": "550",
+    "sports": "22",
+    "countries": 170,
+    "male": 2500,
+    "female": 2400,
+    "participants": 4900,
+}
+
+
+def test_event_bulk_reports_invalid_rows(paralympic_client, paralympic_app):
+    """The valid rows of a JSON array are added in batches and the others are listed with their row number"""
+    paralympic_app.config["API_BULK_BATCH_SIZE"] = 2
+    rows = [NEW_EVENT, {**NEW_EVENT, "year": "soon"}, NEW_EVENT, {**NEW_EVENT, "colour": "gold"}, NEW_EVENT]
+    response = paralympic_client.post("/api/event/bulk", json=rows)
+    assert response.status_code == 201
+    assert response.json["inserted"] == 3
+    assert [error["row"] for error in response.json["errors"]] == [1, 3]
+    assert len(paralympic_client.get("/api/event?year_from=2032").json) == 3
+
+
+def test_noc_bulk_ndjson(paralympic_client):
+    """NDJSON lines are added, a line that is not JSON or a NOC that already exists is reported"""
+    body = '{"NOC": "AAA", "region": "A"}\n{"NOC": "GBR", "region": "Copy"}\nnot json\n{"NOC": "BBB", "region": "B"}\n'
+    response = paralympic_client.post("/api/noc/bulk", data=body, content_type="application/x-ndjson")
+    assert response.status_code == 201
+    assert response.json["inserted"] == 2
+    assert [error["row"] for error in response.json["errors"]] == [1, 2]
+    regions = {region["NOC"]: region["region"] for region in paralympic_client.get("/api/noc").json}
+    assert regions["AAA"] == "A" and regions["BBB"] == "B" and regions["GBR"] == "UK"
+
+
+def test_bulk_empty_body(paralympic_client):
+    """An empty array or NDJSON of blank lines adds nothing and is not an error"""
+    for response in [
+        paralympic_client.post("/api/event/bulk", json=[]),
+        paralympic_client.post("/api/noc/bulk", data="\n\n", content_type="application/x-ndjson"),
+    ]:
+        assert response.status_code == 200
+        assert response.json == {"status": "success", "inserted": 0, "errors": []}
+
+
+def test_event_export(paralympic_client, paralympic_app):
+    """The NDJSON export has the same events as /api/event, sent in chunks, and the CSV has a row for each event"""
+    paralympic_app.config["API_EXPORT_YIELD_PER"] = 10
+    events = paralympic_client.get("/api/event").json
+
+    response = paralympic_client.get("/api/event/export", buffered=False)
+    assert response.is_streamed
+    chunks = list(response.response)
+    assert len(chunks) == 3
+    assert [json.loads(line) for line in b"".join(chunks).splitlines()] == events
+
+    response = paralympic_client.get("/api/event/export?format=csv")
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert [int(row["event_id"]) for row in rows] == [event["event_id"] for event in events]
+    assert paralympic_client.get("/api/noc/export?format=xml").status_code == 400
+
+
+def test_server_timing_and_slow_query_log(paralympic_client, paralympic_app, caplog):
+    """Responses have the number of statements in a Server-Timing header, slow statements are logged with the route"""
+    from paralympic_app import sql_timing
+
+    response = paralympic_client.get("/api/noc/GBR")
+    assert response.headers["Server-Timing"].startswith("db;dur=")
+    assert response.headers["Server-Timing"].endswith('desc="SQL statements: 1"')
+    assert not caplog.records
+
+    sql_timing.slow_query_seconds = 0
+    paralympic_client.get("/api/noc/GBR")
+    assert "on GET /api/noc/GBR" in caplog.text
+    assert "parameters ('GBR',)" in caplog.text
+
+
+def login(client, email="token@example.com"):
+    """Registers a user and returns the token from logging in"""
+    user = {"email": email, "password": "password"}
+    assert client.post("/api/register", json=user).status_code == 201
+    response = client.post("/api/login", json=user)
+    assert response.status_code == 200
+    return response.json["token"]
+
+
+def test_protected_route_caches_token(paralympic_client, sql_statements):
+    """A verified token is cached, so the next request with it does not read the user from the database"""
+    token = login(paralympic_client)
+    assert paralympic_client.post("/api/noc", json={"NOC": "XYZ", "region": "New"}).status_code == 201
+    assert paralympic_client.post("/api/noc", json={"NOC": "XYZ2", "region": "New"}).status_code == 201
+
+    sql_statements.clear()
+    assert paralympic_client.delete("/api/noc/XYZ", headers={"Authorization": token}).status_code == 200
+    assert any("FROM user" in statement for statement in sql_statements)
+
+    sql_statements.clear()
+    assert paralympic_client.delete("/api/noc/XYZ2", headers={"Authorization": token}).status_code == 200
+    assert not any("FROM user" in statement for statement in sql_statements)
+
+    # GBR hosted events, so the foreign key stops it being deleted
+    assert paralympic_client.delete("/api/noc/GBR", headers={"Authorization": token}).status_code == 409
+    assert paralympic_client.delete("/api/noc/GBR", headers={"Authorization": token + "x"}).status_code == 401
+    assert paralympic_client.delete("/api/noc/GBR").status_code == 401
+    assert paralympic_client.post("/api/login", json={"email": "token@example.com", "password": "x"}).status_code == 401
+
+
+def test_token_cache_evicts_changed_user(paralympic_app, paralympic_client):
+    """Changing or deleting a user removes their cached tokens, a deleted user's token is no longer accepted"""
+    from paralympic_app import db, token_cache
+    from paralympic_app.models import User
+
+    token = login(paralympic_client)
+    other_token = login(paralympic_client, "other@example.com")
+    headers = {"Authorization": token}
+    assert paralympic_client.delete("/api/noc/NONE", headers=headers).status_code == 404
+    assert paralympic_client.delete("/api/noc/NONE", headers={"Authorization": other_token}).status_code == 404
+    assert token_cache.stats()["size"] == 2
+
+    with paralympic_app.app_context():
+        user = db.session.execute(db.select(User).filter_by(email="token@example.com")).scalar_one()
+        user.email = "changed@example.com"
+        db.session.commit()
+        assert token_cache.stats()["size"] == 1
+        db.session.delete(user)
+        db.session.commit()
+    assert paralympic_client.delete("/api/noc/NONE", headers=headers).status_code == 401
+    assert paralympic_client.delete("/api/noc/NONE", headers={"Authorization": other_token}).status_code == 404
+
+
+def test_get_requests_read_from_read_only_bind(paralympic_app, paralympic_client):
+    """GET requests read through the read bind, which refuses writes, other requests use the main database"""
+    from paralympic_app import db
+
+    with paralympic_app.app_context():
+        read_engine = db.engines["read"]
+    statements = []
+    event.listen(read_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+    assert paralympic_client.get("/api/event/1").status_code == 200
+    assert paralympic_client.get("/display_event/1").status_code == 200
+    assert len(statements) == 2
+    statements.clear()
+    assert paralympic_client.patch("/api/event/1", json={"highlights": "Updated"}).status_code == 200
+    assert statements == []
+    assert paralympic_client.get("/api/event/1").json["highlights"] == "Updated"
+
+    with read_engine.connect() as connection, pytest.raises(OperationalError):
+        connection.exec_driver_sql("DELETE FROM event")
+
+
+def test_read_bind_uri_replica(paralympic_app, tmp_path):
+    """READ_BIND_URI points the GET requests at another database, e.g. a replica"""
+    from paralympic_app import create_app
+
+    replica = tmp_path.joinpath("replica.db")
+    shutil.copy(paralympic_app.config["SQLALCHEMY_DATABASE_URI"].removeprefix("sqlite:///"), replica)
+    with sqlite3.connect(replica) as connection:
+        connection.execute("DELETE FROM event WHERE event_id > 1")
+
+    client = create_app({**paralympic_app.config, "READ_BIND_URI": f"sqlite:///{replica}"}).test_client()
+    assert [event["event_id"] for event in client.get("/api/event").json] == [1]
+    assert client.patch("/api/event/2", json={"highlights": "Updated"}).status_code == 200
+
+
+def test_password_hashing_pool_shared_by_apps(paralympic_app):
+    """Creating another app reuses the password hashing pool rather than starting more threads"""
+    from paralympic_app import create_app, password_hasher
+
+    pool = password_hasher._executor
+    create_app(paralympic_app.config)
+    assert password_hasher._executor is pool
+    create_app({**paralympic_app.config, "PASSWORD_HASHING_WORKERS": 3})
+    assert password_hasher._executor is not pool
+    assert pool._shutdown
+    assert password_hasher.generate_password_hash("password")
+
+
+def test_streamed_export_has_no_server_timing(paralympic_client, paralympic_app, caplog):
+    """The export's statements run while it is streamed, so they are logged when it closes rather than sent in a header"""
+    paralympic_app.debug = True
+    with caplog.at_level(logging.DEBUG, logger=paralympic_app.logger.name):
+        response = paralympic_client.get("/api/event/export")
+        assert "Server-Timing" not in response.headers
+        response.close()
+    assert "GET /api/event/export ran 1 queries" in caplog.text
+
+
+def test_constraint_errors_are_conflicts(paralympic_client):
+    """Changes that break a constraint, e.g. a NOC that is not a region, get 409 and leave the data unchanged"""
+    event = paralympic_client.get("/api/event/1").json
+    del event["event_id"], event["region"]
+
+    response = paralympic_client.post("/api/event", json={**event, "NOC": "ZZZ"})
+    assert response.status_code == 409
+    assert "FOREIGN KEY" in response.json["message"]
+    assert paralympic_client.patch("/api/event/1", json={"NOC": "ZZZ"}).status_code == 409
+    assert paralympic_client.get("/api/event/1").json["NOC"] == event["NOC"]
+    assert paralympic_client.patch("/api/noc/GBR", json={"NOC": "GBX"}).status_code == 409
+    assert paralympic_client.post("/api/noc", json={"NOC": "GBR", "region": "Copy"}).status_code == 409
+    assert paralympic_client.get("/api/noc/GBR").json["region"] == "UK"
+    # The session is usable again after the rollback
+    assert paralympic_client.patch("/api/event/1", json={"highlights": "Updated"}).status_code == 200
+
+
+def test_shipped_events_without_region(paralympic_app):
+    """The foreign key is only checked for new and changed rows, the data already has an event whose NOC has no
+    region, event 2 with JAP, which the API returns with a null region"""
+    database = paralympic_app.config["SQLALCHEMY_DATABASE_URI"].removeprefix("sqlite:///")
+    with sqlite3.connect(database) as connection:
+        assert connection.execute("PRAGMA foreign_key_check").fetchall() == [("event", 2, "region", 0)]
+    client = paralympic_app.test_client()
+    assert client.get("/api/event/2").json["region"] is None
+    assert client.patch("/api/event/2", json={"highlights": "Updated"}).status_code == 200
+
+
+def test_token_cache_follows_user_table_version(paralympic_app, paralympic_client, sql_statements):
+    """A new version of the user table, e.g. from a change committed in another worker, stops the cached tokens being
+    used, a change that is only flushed or rolled back does not"""
+    from paralympic_app import data_versions, db
+    from paralympic_app.models import User
+
+    headers = {"Authorization": login(paralympic_client)}
+    paralympic_client.delete("/api/noc/NONE", headers=headers)
+    version = data_versions.version("user")
+
+    with paralympic_app.app_context():
+        user = db.session.execute(db.select(User).filter_by(email="token@example.com")).scalar_one()
+        user.email = "flushed@example.com"
+        db.session.flush()
+        db.session.rollback()
+    assert data_versions.version("user") == version
+    sql_statements.clear()
+    assert paralympic_client.delete("/api/noc/NONE", headers=headers).status_code == 404
+    assert not any("FROM user" in statement for statement in sql_statements)
+
+    # As bumped by another worker sharing DATA_VERSION_FOLDER
+    data_versions.bump("user")
+    sql_statements.clear()
+    assert paralympic_client.delete("/api/noc/NONE", headers=headers).status_code == 404
+    assert any("FROM user" in statement for statement in sql_statements)
@@ -0,0 +1,66 @@
+import pytest
+
+
+# Most SQL statements a GET route may run, however many rows the tables have
+MAX_QUERIES = 2
+
+GET_ROUTES = [
+    "/",
+    "/display_event/1",
+    "/api/event",
+    "/api/event?type=Winter&year_from=1990&fields=year,region",
+    "/api/event?limit=10&after=5",
+    "/api/event/1",
+    "/api/event/export",
+    "/api/event/export?format=csv",
+    "/api/noc",
+    "/api/noc/GBR",
+    "/api/noc/export",
+]
+
+
+def count_queries(client, sql_statements, url):
+    """Returns the number of SQL statements run by a GET request to the url"""
+    sql_statements.clear()
+    response = client.get(url)
+    assert response.status_code == 200
+    return len(sql_statements)
+
+
+def add_rows(client, events, regions):
+    """Adds copies of the first event and new regions with the bulk routes"""
+    event = client.get("/api/event/1").json
+    del event["event_id"], event["region"]
+    event.update(male=0, female=0)
+    response = client.post("/api/event/bulk", json=[event] * events)
+    assert response.json["inserted"] == events
+    response = client.post(
+        "/api/noc/bulk", json=[{"NOC": f"X{number:03}", "region": "New"} for number in range(regions)]
+    )
+    assert response.json["inserted"] == regions
+
+
+@pytest.mark.parametrize("url", GET_ROUTES)
+def test_queries_do_not_grow_with_rows(paralympic_client, sql_statements, url):
+    """Each GET route runs the same small number of queries after many rows have been added"""
+    before = count_queries(paralympic_client, sql_statements, url)
+    add_rows(paralympic_client, events=300, regions=100)
+    after = count_queries(paralympic_client, sql_statements, url)
+    assert after == before, f"{url} ran {before} queries, then {after} with more rows"
+    assert after <= MAX_QUERIES, f"{url} ran {after} queries"
+
+
+@pytest.mark.parametrize("strategy", ["joined", "selectin", "lazy"])
+def test_event_region_loading(paralympic_app, sql_statements, strategy):
+    """Dumping events with the region relationship takes one query when joined, two with selectin, and one more for
+    each NOC when lazy"""
+    from paralympic_app import db
+    from paralympic_app.models import Event
+    from paralympic_app.utilities import events_schema, loader_options
+
+    paralympic_app.config["API_RELATIONSHIP_LOADING"]["Event.region"] = strategy
+    with paralympic_app.app_context():
+        query = db.select(Event).options(*loader_options(events_schema, Event))
+        events = events_schema.dump(db.session.execute(query).scalars())
+    regions = len({event["NOC"] for event in events})
+    assert len(sql_statements) == {"joined": 1, "selectin": 2, "lazy": 1 + regions}[strategy]
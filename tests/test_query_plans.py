@@ -0,0 +1,90 @@
+import sqlite3
+import pytest
+from sqlalchemy import event
+
+
+# Tables that grow with the data, a query that picks some of their rows must use an index rather than read them all
+LARGE_TABLES = ("event", "user")
+
+ROUTES = [
+    ("GET", "/", None),
+    ("GET", "/display_event/1", None),
+    ("GET", "/api/event", None),
+    ("GET", "/api/event?type=Winter", None),
+    # Not year_from on its own: an open range usually matches a large share of the events, so SQLite rightly reads
+    # the table in event_id order rather than the index followed by a sort
+    ("GET", "/api/event?year_from=1990&year_to=2000", None),
+    ("GET", "/api/event?type=Winter&year_from=1990&fields=year,region", None),
+    ("GET", "/api/event?NOC=GBR", None),
+    ("GET", "/api/event?limit=10&after=5", None),
+    ("GET", "/api/event/1", None),
+    ("GET", "/api/event/export", None),
+    ("GET", "/api/noc", None),
+    ("GET", "/api/noc/GBR", None),
+    ("GET", "/api/noc/export", None),
+    ("PATCH", "/api/event/1", {"highlights": "New highlights"}),
+    ("PATCH", "/api/noc/GBR", {"notes": "New notes"}),
+    ("POST", "/api/register", {"email": "plan@example.com", "password": "password"}),
+    ("POST", "/api/login", {"email": "plan@example.com", "password": "password"}),
+]
+
+
+def scans(connection, statement, parameters):
+    """Returns the lines of the query plan of the statement that read every row of a large table"""
+    plan = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters).fetchall()
+    return [
+        row[-1]
+        for row in plan
+        if row[-1].startswith("SCAN") and row[-1].split()[1].strip('"') in LARGE_TABLES
+    ]
+
+
+@pytest.mark.parametrize("method,url,data", ROUTES)
+def test_routes_use_indexes(paralympic_app, method, url, data):
+    """The statements run by each route only read all of a large table when they have no WHERE clause, i.e. when the
+    route returns the whole table"""
+    from paralympic_app import db
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(("SELECT", "UPDATE", "DELETE")):
+            statements.append((statement, parameters))
+
+    client = paralympic_app.test_client()
+    if url == "/api/login":
+        client.post("/api/register", json=data)
+    with paralympic_app.app_context():
+        engine = db.engine
+        engines = list(db.engines.values())
+    for listened in engines:
+        event.listen(listened, "before_cursor_execute", record)
+    try:
+        response = client.open(url, method=method, json=data)
+    finally:
+        for listened in engines:
+            event.remove(listened, "before_cursor_execute", record)
+    assert response.status_code < 400, response.data
+    assert statements
+
+    with engine.connect() as connection:
+        for statement, parameters in statements:
+            if " WHERE " not in statement.upper().replace("\n", " "):
+                continue
+            assert not scans(connection, statement, parameters), f"{url} scans a large table: {statement}"
+
+
+def test_indexes_added_to_existing_database(paralympic_app):
+    """Starting the app adds the indexes of the models to a database made without them"""
+    from paralympic_app import create_app
+
+    database = paralympic_app.config["SQLALCHEMY_DATABASE_URI"].removeprefix("sqlite:///")
+    with sqlite3.connect(database) as connection:
+        for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE name LIKE 'ix_event_%'").fetchall():
+            connection.execute(f"DROP INDEX {name}")
+
+    create_app(paralympic_app.config)
+
+    with sqlite3.connect(database) as connection:
+        indexes = {name for (name,) in connection.execute("SELECT name FROM sqlite_master WHERE type = 'index'")}
+    assert {"ix_event_type_year", "ix_event_year", "ix_event_NOC"} <= indexes
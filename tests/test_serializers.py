@@ -0,0 +1,87 @@
+import pytest
+from flask import make_response
+from sqlalchemy import text
+
+
+# Events with values that the fast serializer has to convert like Marshmallow: numbers stored as text and text
+# stored as numbers, missing values, characters that are not ASCII and a DEL character. Event 2 in the data has a NOC
+# with no region.
+EDGE_CASE_EVENTS = """
+INSERT INTO event (type, year, location, lat, lon, NOC, start, end, disabilities_included, events, sports,
+                   countries, male, female, participants, highlights)
+VALUES ('Summer', '2032', 'Brisbane', NULL, 153.0281, 'AUS', '24-Aug-32', '5-Sep-32', 'All', 550, 22.5,
+        '170', 2500, 2400, 4900, 'Zürich → Brisbane ✓ 🏅'),
+       ('Winter', 2034, 'Salt Lake City', '40.7608', '-111.891', 'USA', '1-Mar-34', '10-Mar-34', 'All', '80', '6',
+        45, NULL, NULL, 700, 'tab	and del' || char(127))
+"""
+
+
+@pytest.fixture()
+def serializer_context(paralympic_app):
+    """Request context of the paralympic app with the edge case events added to the database"""
+    from paralympic_app import db
+
+    with paralympic_app.test_request_context():
+        db.session.execute(text(EDGE_CASE_EVENTS))
+        db.session.commit()
+        yield paralympic_app
+
+
+def schema_events(fields=None):
+    """Events dumped by the Marshmallow schema as before, in event_id order"""
+    from paralympic_app import db
+    from paralympic_app.models import Event
+    from paralympic_app.schemas import EventSchema
+
+    events = db.session.execute(db.select(Event).order_by(Event.event_id)).scalars()
+    return EventSchema(many=True, only=fields).dump(events)
+
+
+@pytest.mark.parametrize("debug", [False, True])
+def test_events_json_matches_schema(serializer_context, debug):
+    """The JSON of all events is byte for byte the same as the schema's dump encoded by Flask"""
+    from paralympic_app.serializers import json_response
+    from paralympic_app.utilities import get_events
+
+    serializer_context.debug = debug
+    expected = make_response(schema_events()).get_data()
+    assert json_response(get_events()).get_data() == expected
+
+
+@pytest.mark.parametrize(
+    "fields", [["year"], ["region", "highlights"], ["lat", "lon", "countries", "events", "sports"]]
+)
+def test_projected_events_match_schema(serializer_context, fields):
+    """Only returning some fields gives the same JSON as a schema with only those fields and event_id"""
+    from paralympic_app.serializers import json_response
+    from paralympic_app.utilities import get_events
+
+    expected = make_response(schema_events(fields + ["event_id"])).get_data()
+    assert json_response(get_events(fields=fields)).get_data() == expected
+
+
+def test_event_matches_schema(serializer_context):
+    """A single event gives the same dict as the schema, including the edge cases"""
+    from paralympic_app.utilities import get_event
+
+    for expected in schema_events():
+        assert get_event(expected["event_id"]) == expected
+    assert get_event(10**6) is None
+
+
+@pytest.mark.parametrize(
+    "data",
+    [
+        ["plain"],
+        [{"text": "Zürich → ✓"}],
+        [{"text": "🏅 and del \x7f"}],
+        [{"path": "C:\\xfc\\Users ü", "quote": '"→"'}],
+        [{"control": "\x00\x1f\t\n", "\u00e9": 1, "e": None}],
+    ],
+)
+def test_json_response_matches_flask(paralympic_app, data):
+    """Escaping the characters in orjson's output gives the same bytes as Flask"""
+    from paralympic_app.serializers import json_response
+
+    with paralympic_app.test_request_context():
+        assert json_response(data).get_data() == make_response(data).get_data()
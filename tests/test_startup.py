@@ -0,0 +1,35 @@
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+import pytest
+
+
+PROJECT_ROOT = Path(__file__).parent.parent
+
+# Seconds each app factory may take in a new interpreter, imports included.
+# Set STARTUP_BUDGET_SCALE to allow more time on a slower machine, e.g. STARTUP_BUDGET_SCALE=2
+STARTUP_BUDGETS = {"iris_app": 1.5, "paralympic_app": 3.0}
+
+
+@pytest.mark.parametrize("package", STARTUP_BUDGETS)
+def test_cold_start_within_budget(package):
+    """Creates the app in a new Python process and fails if it takes longer than the budget"""
+    code = (
+        "import time\n"
+        "start = time.perf_counter()\n"
+        f"from {package} import create_app\n"
+        "create_app()\n"
+        "print(f'startup seconds {time.perf_counter() - start}')\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=PROJECT_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    seconds = float(re.search(r"startup seconds (\S+)", result.stdout).group(1))
+    budget = STARTUP_BUDGETS[package] * float(os.environ.get("STARTUP_BUDGET_SCALE", 1))
+    assert seconds < budget, f"{package} took {seconds:.2f}s to start, the budget is {budget:.2f}s"